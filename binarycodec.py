@@ -0,0 +1,334 @@
+# binarycodec.py
+"""MessagePack encoding for protocol frames.
+
+A compact binary alternative to JSON that clients can negotiate per
+connection (see the hello command). Small integers, short strings and small
+containers are encoded in a single type byte, numbers are sent in binary
+rather than as decimal text, and nothing needs escaping.
+
+The msgpack extension is used when it is installed; otherwise a pure-Python
+implementation of the same subset of the format (nil, booleans, integers up
+to 64 bits, floats, str, bin, arrays and maps) is used. Both produce
+identical bytes, so either side may have the extension or not.
+
+Messages are the same values JSON carries, so they hold no bytes. bin is
+used instead for strings that are not valid Unicode, such as the
+surrogate-escaped names os.scandir returns for filenames that are not UTF-8:
+they are sent as their original bytes and decoded back to the same string,
+as JSON's \\udcXX escapes are.
+"""
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class PackError(ValueError):
+    """Raised when a frame body is not valid MessagePack"""
+
+
+_PACK_UINT8 = struct.Struct('>BB').pack
+_PACK_UINT16 = struct.Struct('>BH').pack
+_PACK_UINT32 = struct.Struct('>BI').pack
+_PACK_UINT64 = struct.Struct('>BQ').pack
+_PACK_INT8 = struct.Struct('>Bb').pack
+_PACK_INT16 = struct.Struct('>Bh').pack
+_PACK_INT32 = struct.Struct('>Bi').pack
+_PACK_INT64 = struct.Struct('>Bq').pack
+_PACK_FLOAT = struct.Struct('>Bd').pack
+
+# Single-byte encodings of the values that are sent most often
+_SMALL_INTS = {value: bytes([value]) for value in range(128)}
+_SMALL_INTS.update({value: bytes([value & 0xff]) for value in range(-32, 0)})
+# Encoded map keys; responses reuse a small vocabulary of them
+_KEYS = {}
+_MAX_KEYS = 4096
+
+
+def _pack_int(value, out):
+    encoded = _SMALL_INTS.get(value)
+    if encoded is not None:
+        out.append(encoded)
+    elif value >= 0:
+        if value <= 0xff:
+            out.append(_PACK_UINT8(0xcc, value))
+        elif value <= 0xffff:
+            out.append(_PACK_UINT16(0xcd, value))
+        elif value <= 0xffffffff:
+            out.append(_PACK_UINT32(0xce, value))
+        elif value <= 0xffffffffffffffff:
+            out.append(_PACK_UINT64(0xcf, value))
+        else:
+            raise OverflowError(f"Integer {value} does not fit in 64 bits")
+    elif value >= -0x80:
+        out.append(_PACK_INT8(0xd0, value))
+    elif value >= -0x8000:
+        out.append(_PACK_INT16(0xd1, value))
+    elif value >= -0x80000000:
+        out.append(_PACK_INT32(0xd2, value))
+    elif value >= -0x8000000000000000:
+        out.append(_PACK_INT64(0xd3, value))
+    else:
+        raise OverflowError(f"Integer {value} does not fit in 64 bits")
+
+
+def _pack_str(value, out):
+    try:
+        data = value.encode('utf-8')
+    except UnicodeEncodeError:
+        _pack_bin(_encode_unpaired(value), out)
+        return
+    length = len(data)
+    if length < 32:
+        out.append(bytes([0xa0 | length]))
+    elif length <= 0xff:
+        out.append(_PACK_UINT8(0xd9, length))
+    elif length <= 0xffff:
+        out.append(_PACK_UINT16(0xda, length))
+    else:
+        out.append(_PACK_UINT32(0xdb, length))
+    out.append(data)
+
+
+def _pack_bin(value, out):
+    length = len(value)
+    if length <= 0xff:
+        out.append(_PACK_UINT8(0xc4, length))
+    elif length <= 0xffff:
+        out.append(_PACK_UINT16(0xc5, length))
+    else:
+        out.append(_PACK_UINT32(0xc6, length))
+    out.append(bytes(value))
+
+
+def _encode_unpaired(value):
+    """Bytes of a string holding unpaired surrogates"""
+    try:
+        # Surrogate-escaped filenames get their original bytes back
+        return value.encode('utf-8', 'surrogateescape')
+    except UnicodeEncodeError:
+        # Other lone surrogates cannot come from the filesystem; keep them decodable
+        return value.encode('utf-8', 'surrogatepass')
+
+
+def _decode_bin(data):
+    return data.decode('utf-8', 'surrogateescape')
+
+
+def _pack_header(length, fix, code16, code32, out):
+    if length < 16:
+        out.append(bytes([fix | length]))
+    elif length <= 0xffff:
+        out.append(_PACK_UINT16(code16, length))
+    else:
+        out.append(_PACK_UINT32(code32, length))
+
+
+def _pack(value, out):
+    kind = type(value)
+    if kind is str:
+        _pack_str(value, out)
+    elif kind is int:
+        _pack_int(value, out)
+    elif kind is dict:
+        _pack_header(len(value), 0x80, 0xde, 0xdf, out)
+        append = out.append
+        for key, item in value.items():
+            # Keys repeat from row to row, so their encodings are remembered
+            encoded = _KEYS.get(key)
+            if encoded is None:
+                encoded = _pack_key(key)
+            append(encoded)
+            kind = type(item)
+            if kind is str and len(item) < 32 and item.isascii():
+                append(bytes([0xa0 | len(item)]))
+                append(item.encode('ascii'))
+            elif kind is float:
+                append(_PACK_FLOAT(0xcb, item))
+            else:
+                _pack(item, out)
+    elif kind is list or kind is tuple:
+        _pack_header(len(value), 0x90, 0xdc, 0xdd, out)
+        for item in value:
+            _pack(item, out)
+    elif kind is float:
+        out.append(_PACK_FLOAT(0xcb, value))
+    elif value is None:
+        out.append(b'\xc0')
+    elif value is True:
+        out.append(b'\xc3')
+    elif value is False:
+        out.append(b'\xc2')
+    elif kind is bytes or kind is bytearray:
+        _pack_bin(value, out)
+    elif isinstance(value, int):
+        _pack_int(int(value), out)
+    elif isinstance(value, float):
+        out.append(_PACK_FLOAT(0xcb, float(value)))
+    elif isinstance(value, str):
+        _pack_str(str(value), out)
+    elif isinstance(value, dict):
+        _pack(dict(value), out)
+    elif isinstance(value, (list, tuple)):
+        _pack(list(value), out)
+    else:
+        raise TypeError(f"Object of type {kind.__name__} is not MessagePack serializable")
+
+
+def _pack_key(key):
+    """Encoding of a map key, remembered if it is a short string"""
+    out = []
+    _pack(key, out)
+    encoded = b''.join(out)
+    if type(key) is str and len(encoded) <= 32 and len(_KEYS) < _MAX_KEYS:
+        _KEYS[key] = encoded
+    return encoded
+
+
+def packb(value):
+    """Encode value as MessagePack bytes"""
+    if msgpack is not None:
+        try:
+            return msgpack.packb(value, use_bin_type=True)
+        except UnicodeEncodeError:
+            # The extension cannot send strings that are not valid Unicode; the bytes come out the same
+            pass
+    out = []
+    _pack(value, out)
+    return b''.join(out)
+
+
+_UNPACK = {code: struct.Struct(fmt).unpack_from for code, fmt in (
+    (0xca, '>f'), (0xcb, '>d'),
+    (0xcc, '>B'), (0xcd, '>H'), (0xce, '>I'), (0xcf, '>Q'),
+    (0xd0, '>b'), (0xd1, '>h'), (0xd2, '>i'), (0xd3, '>q'),
+)}
+_UNPACK_FLOAT = _UNPACK[0xcb]
+# Decoded map keys by their encoding
+_DECODED_KEYS = {}
+_SIZES = {0xca: 4, 0xcb: 8, 0xcc: 1, 0xcd: 2, 0xce: 4, 0xcf: 8, 0xd0: 1, 0xd1: 2, 0xd2: 4, 0xd3: 8}
+_LENGTHS = {code: (struct.Struct(fmt).unpack_from, size) for code, fmt, size in (
+    (0xc4, '>B', 1), (0xc5, '>H', 2), (0xc6, '>I', 4),
+    (0xd9, '>B', 1), (0xda, '>H', 2), (0xdb, '>I', 4),
+    (0xdc, '>H', 2), (0xdd, '>I', 4), (0xde, '>H', 2), (0xdf, '>I', 4),
+)}
+
+
+def _unpack(data, position):
+    """(value, position after it) for the value encoded at position"""
+    code = data[position]
+    position += 1
+    if code <= 0x7f:
+        return code, position
+    if 0xa0 <= code <= 0xbf:
+        end = position + (code & 0x1f)
+        if end > len(data):
+            raise PackError("Truncated MessagePack data")
+        return data[position:end].decode('utf-8'), end
+    if 0x90 <= code <= 0x9f:
+        return _unpack_array(data, position, code & 0x0f)
+    if 0x80 <= code <= 0x8f:
+        return _unpack_map(data, position, code & 0x0f)
+    if code >= 0xe0:
+        return code - 0x100, position
+    if code == 0xc0:
+        return None, position
+    if code == 0xc2:
+        return False, position
+    if code == 0xc3:
+        return True, position
+    unpack = _UNPACK.get(code)
+    if unpack is not None:
+        return unpack(data, position)[0], position + _SIZES[code]
+    length = _LENGTHS.get(code)
+    if length is None:
+        raise PackError(f"Unsupported MessagePack type 0x{code:02x}")
+    unpack_length, size = length
+    count = unpack_length(data, position)[0]
+    position += size
+    if code >= 0xde:
+        return _unpack_map(data, position, count)
+    if code >= 0xdc:
+        return _unpack_array(data, position, count)
+    end = position + count
+    if end > len(data):
+        raise PackError("Truncated MessagePack data")
+    if code >= 0xd9:
+        return data[position:end].decode('utf-8'), end
+    return _decode_bin(data[position:end]), end
+
+
+def _unpack_array(data, position, count):
+    items = []
+    append = items.append
+    for _ in range(count):
+        item, position = _unpack(data, position)
+        append(item)
+    return items, position
+
+
+def _unpack_map(data, position, count):
+    items = {}
+    for _ in range(count):
+        # Short string keys and scalar values are decoded inline, saving a call each
+        code = data[position]
+        if 0xa0 <= code <= 0xbf:
+            end = position + 1 + (code & 0x1f)
+            key = _DECODED_KEYS.get(data[position:end])
+            if key is None:
+                key, end = _unpack(data, position)
+                if len(_DECODED_KEYS) < _MAX_KEYS:
+                    _DECODED_KEYS[data[position:end]] = key
+            position = end
+        else:
+            key, position = _unpack(data, position)
+        code = data[position]
+        if code <= 0x7f:
+            items[key] = code
+            position += 1
+        elif 0xa0 <= code <= 0xbf:
+            end = position + 1 + (code & 0x1f)
+            if end > len(data):
+                raise PackError("Truncated MessagePack data")
+            items[key] = data[position + 1:end].decode('utf-8')
+            position = end
+        elif code == 0xcb:
+            items[key] = _UNPACK_FLOAT(data, position + 1)[0]
+            position += 9
+        else:
+            items[key], position = _unpack(data, position)
+    return items, position
+
+
+def _bin_to_str(value):
+    """value with the bytes the extension decoded from bin turned back into strings"""
+    kind = type(value)
+    if kind is bytes:
+        return _decode_bin(value)
+    if kind is list:
+        return [_bin_to_str(item) for item in value]
+    if kind is dict:
+        return {_bin_to_str(key): _bin_to_str(item) for key, item in value.items()}
+    return value
+
+
+def unpackb(data):
+    """Decode a single MessagePack value that makes up all of data"""
+    if msgpack is not None:
+        try:
+            value = msgpack.unpackb(data, raw=False, strict_map_key=False)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as e:
+            raise PackError(str(e)) from None
+        # Only walk the value when a bin type byte appears somewhere in data
+        if b'\xc4' in data or b'\xc5' in data or b'\xc6' in data:
+            value = _bin_to_str(value)
+        return value
+    try:
+        value, position = _unpack(data, 0)
+    except (IndexError, struct.error, TypeError, RecursionError) as e:
+        raise PackError(f"Truncated or malformed MessagePack data: {e}") from None
+    if position != len(data):
+        raise PackError(f"{len(data) - position} bytes of extra data after the value")
+    return value
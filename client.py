@@ -1,11 +1,17 @@
 # client.py
 import socket
-import json
 import argparse
 import os
 import sys
 import textwrap
 import datetime
+import hmac
+import secrets
+import threading
+import time
+from collections import deque
+from protocol import (COMPRESSIONS, DEFAULT_MAX_FRAME_SIZE, ENCODINGS, FrameReader, auth_proof, column_arrays,
+                      decode_message, encode_message)
 
 # Try to import readline for Unix systems, otherwise use a fallback for Windows
 try:
@@ -15,11 +21,34 @@ except ImportError:
     pass
 
 class RemoteCommandClient:
-    def __init__(self,host='127.0.0.1', port=9999, token=None):
+    # Commands whose tables the shell asks for in columnar form
+    COLUMNAR_COMMANDS = ('listdir', 'processlist', 'findfile')
+    
+    def __init__(self,host='127.0.0.1', port=9999, token=None, max_frame_size=DEFAULT_MAX_FRAME_SIZE, deadline=None,
+                 encoding='json', compression=None, heartbeat=None):
         self.host = host
         self.port = port
         self.token = token or os.environ.get('RCE_TOKEN')
+        self.max_frame_size = max_frame_size
+        self.deadline = deadline
+        # Encoding and compression to ask for on connect, and those in use once the server has answered
+        self.preferred_encoding = encoding
+        self.preferred_compression = compression
+        self.encoding = 'json'
+        self.compression = None
+        # True once the connection itself is trusted, so requests go out without the token
+        self.session = False
+        # Seconds of silence after which a heartbeat is sent, so the server does not reap an idle shell
+        self.heartbeat = heartbeat
+        self._heartbeat_stopped = threading.Event()
+        self._send_lock = threading.Lock()
+        self.last_sent = 0.0
         self.socket = None
+        self.frames = None
+        self.next_id = 0
+        self.pending = {}
+        self.find_cursor = None
+        self.list_cursor = None
         self.connected = False
         
         # Define the available commands and their descriptions
@@ -27,17 +56,23 @@ class RemoteCommandClient:
             'help': 'Show this help message',
             'exit': 'Exit the shell and disconnect',
             'sysinfo': 'Get system information from the remote machine',
-            'listdir': 'List contents of a directory (args: path)',
-            'diskspace': 'Get disk space information (args: path)',
-            'processlist': 'List running processes (args: limit)',
+            'listdir': 'List contents of a directory, a page at a time (args: path)',
+            'listnext': 'Show the next page of the previous listdir',
+            'diskspace': 'Get disk space information (args: path, or "all" for every mount)',
+            'du': 'Show the size of a directory tree and its largest directories (args: path, top)',
+            'processlist': 'List top running processes (args: limit, sort: memory_percent|cpu_percent|rss|num_threads)',
             'meminfo': 'Get memory usage information',
             'netinfo': 'Get network interfaces information',
             'fileinfo': 'Get information about a specific file (args: path)',
             'uptime': 'Get system uptime',
             'hostname': 'Get the system hostname',
             'echo': 'Echo a message back (args: message)',
-            'ping': 'Ping a remote host (args: host, count)',
-            'findfile': 'Find files matching a pattern (args: pattern, path)'
+            'ping': 'Ping one or more remote hosts (args: host [host ...], count, tcp:PORT for TCP connect)',
+            'findfile': 'Find files matching a pattern, streamed as found (args: [prefix:|glob:|regex:]pattern, path)',
+            'findnext': 'Continue the previous findfile where it stopped',
+            'batch': 'Run several argument-less commands in one request (args: command names)',
+            'stats': 'Get server connection and admission counters',
+            'refresh': 'Recompute the server\'s cached sysinfo and hostname facts'
         }
         
     def connect(self):
@@ -45,18 +80,79 @@ class RemoteCommandClient:
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
+            self.frames = FrameReader(self.max_frame_size)
             self.connected = True
             print(f"[+] Connected to {self.host}:{self.port}")
+            if self.token or self.preferred_encoding != 'json' or self.preferred_compression:
+                self.negotiate(self.preferred_encoding, self.preferred_compression)
+            if self.heartbeat:
+                self._heartbeat_stopped.clear()
+                threading.Thread(target=self._send_heartbeats, name='rce-heartbeat', daemon=True).start()
             return True
         except Exception as e:
             print(f"[-] Failed to connect: {e}")
+            if self.socket:
+                self.socket.close()
+            self.connected = False
             return False
             
+    def negotiate(self, encoding='json', compression=None):
+        """Ask the server to switch this connection's encoding and compression, and authenticate it
+        
+        JSON and uncompressed frames are kept for whatever the server declines.
+        A server too old to know hello answers with an error, and the token is
+        then sent inside every request as before.
+        """
+        args = {'encodings': [encoding, 'json']}
+        if compression:
+            args['compression'] = [compression]
+        request = self._build_request('hello', args)
+        self._send(request)
+        response = self._receive(request['id'])
+        if response.get('status') == 'success':
+            result = response['result']
+            self.encoding = result['encoding']
+            if result.get('compression'):
+                self.compression = COMPRESSIONS[result['compression']](result.get('compress_threshold', 0))
+                self.frames.compression = self.compression
+            if 'challenge' in result:
+                self.authenticate(result['challenge'])
+            else:
+                # The server does not ask for a token
+                self.session = True
+        if self.encoding != encoding:
+            print(f"[-] Server does not support {encoding} encoding, using {self.encoding}")
+        if compression and self.compression is None:
+            print(f"[-] Server does not support {compression} compression, frames stay uncompressed")
+        return self.encoding, self.compression
+    
+    def authenticate(self, challenge):
+        """Answer a hello challenge, proving knowledge of the token without sending it
+        
+        Raises ConnectionError if the server's proof in return is wrong.
+        """
+        if not self.token:
+            print("[-] Server requires a token")
+            return False
+        nonce = secrets.token_hex(16)
+        request = self._build_request('auth', {'response': auth_proof(self.token, 'client', challenge, nonce), 'nonce': nonce})
+        self._send(request)
+        response = self._receive(request['id'])
+        if response.get('status') != 'success':
+            print(f"[-] Authentication failed: {response.get('error', 'Unknown error')}")
+            return False
+        expected = auth_proof(self.token, 'server', challenge, nonce)
+        if not hmac.compare_digest(str(response['result'].get('proof', '')), expected):
+            raise ConnectionError("Server could not prove it knows the token")
+        self.session = True
+        return True
+    
     def disconnect(self):
         """Disconnect from the server"""
+        self._heartbeat_stopped.set()
         if self.connected and self.socket:
             try:
-                self.send_command('exit')
+                self._send({'command': 'exit'})
                 self.socket.close()
             except:
                 pass
@@ -65,38 +161,111 @@ class RemoteCommandClient:
             
     def send_command(self, command, args=None):
         """Send a command to the server and return the response"""
+        responses = self.send_pipelined([(command, args)])
+        return responses[0] if responses else None
+    
+    def send_pipelined(self, commands):
+        """Send several (command, args) pairs back-to-back and return their responses in order
+        
+        All requests go out before any response is read, so the whole batch
+        costs a single round-trip; the server may complete them out of order.
+        """
         if not self.connected:
             print("[-] Not connected to any server")
             return None
             
         try:
-            # Prepare command data
-            command_data = {'command': command}
-            if args:
-                command_data['args'] = args
-            if self.token:
-                command_data['token'] = self.token
-                
-            serialized_data = json.dumps(command_data).encode('utf-8')
-            
-            # Send command
-            self.socket.sendall(serialized_data)
-            
-            # Receive response
-            response_data = self.socket.recv(16384)
-            if not response_data:
-                print("[-] Connection closed by server")
-                self.connected = False
-                return None
-                
-            # Parse response
-            response = json.loads(response_data.decode('utf-8'))
-            return response
+            requests = [self._build_request(command, args) for command, args in commands]
+            self._send(*requests)
+            return [self._receive(request['id']) for request in requests]
             
         except Exception as e:
             print(f"[-] Error sending command: {e}")
             self.connected = False
             return None
+    
+    def _build_request(self, command, args):
+        """Prepare the request envelope for a command"""
+        self.next_id += 1
+        command_data = {'id': self.next_id, 'command': command}
+        if args:
+            command_data['args'] = args
+        # The token only travels in requests to servers without the handshake, and never in it
+        if self.token and not self.session and command not in ('hello', 'auth'):
+            command_data['token'] = self.token
+        if self.deadline:
+            command_data['deadline'] = self.deadline
+        return command_data
+    
+    def cancel(self, request_id):
+        """Ask the server to stop an in-flight request; True if it was still running"""
+        request = self._build_request('cancel', {'id': request_id})
+        self._send(request)
+        response = self._receive(request['id'])
+        return bool(response.get('result', {}).get('cancelled'))
+    
+    def stream_command(self, command, args=None):
+        """Send a streaming request and yield each response chunk as it arrives"""
+        if not self.connected:
+            print("[-] Not connected to any server")
+            return
+            
+        try:
+            request = self._build_request(command, {**(args or {}), 'stream': True})
+            self._send(request)
+            while True:
+                chunk = self._receive(request['id'])
+                yield chunk
+                if not chunk.get('more'):
+                    break
+                    
+        except Exception as e:
+            print(f"[-] Error sending command: {e}")
+            self.connected = False
+    
+    def _send(self, *requests):
+        """Write requests as one burst of frames
+        
+        The heartbeat thread writes too, so frames (and the compressor state
+        they advance) must not interleave.
+        """
+        with self._send_lock:
+            self.socket.sendall(b''.join(encode_message(request, self.encoding, self.compression) for request in requests))
+            self.last_sent = time.monotonic()
+    
+    def _send_heartbeats(self):
+        """Heartbeat thread: send a heartbeat whenever nothing else went out for a whole interval"""
+        while not self._heartbeat_stopped.wait(self.heartbeat / 4):
+            if not self.connected:
+                return
+            if time.monotonic() - self.last_sent < self.heartbeat:
+                continue
+            try:
+                # The server never answers heartbeats, so there is nothing to read back
+                request = {'command': 'heartbeat'}
+                if self.token and not self.session:
+                    request['token'] = self.token
+                self._send(request)
+            except OSError:
+                return
+    
+    def _receive(self, request_id):
+        """Read frames until a response to request_id arrives, keeping any others for later"""
+        while not self.pending.get(request_id):
+            # Receive a complete response frame, however many reads it takes
+            response_data = self.frames.recv_frame(self.socket)
+            if response_data is None:
+                raise ConnectionError("Connection closed by server")
+            response = decode_message(response_data, self.encoding)
+            if 'id' not in response:
+                # Every request carries an id, so this is about the connection itself (busy, bad frame)
+                raise ConnectionError(f"Server closed the connection: {response.get('error', 'Unknown error')}")
+            self.pending.setdefault(response['id'], deque()).append(response)
+        responses = self.pending[request_id]
+        response = responses.popleft()
+        if not responses:
+            del self.pending[request_id]
+        return response
             
     def start_shell(self):
         """Start an interactive shell with the server"""
@@ -128,26 +297,68 @@ class RemoteCommandClient:
                     
                 # Parse command-specific arguments
                 args = {}
-                if command == 'listdir' or command == 'diskspace' or command == 'fileinfo':
+                if command == 'diskspace' and args_str == 'all':
+                    args['all'] = True
+                elif command == 'listdir' or command == 'diskspace' or command == 'fileinfo':
                     if args_str:
                         args['path'] = args_str
+                elif command == 'du':
+                    for value in args_str.split():
+                        if value.isdigit():
+                            args['top'] = int(value)
+                        else:
+                            args['path'] = value
                 elif command == 'processlist':
-                    if args_str and args_str.isdigit():
-                        args['limit'] = int(args_str)
+                    for value in args_str.split():
+                        if value.isdigit():
+                            args['limit'] = int(value)
+                        else:
+                            args['sort'] = value
                 elif command == 'echo':
                     args['message'] = args_str
                 elif command == 'ping':
-                    ping_args = args_str.split(' ')
-                    if ping_args:
-                        args['host'] = ping_args[0]
-                        if len(ping_args) > 1 and ping_args[1].isdigit():
-                            args['count'] = int(ping_args[1])
+                    ping_args = args_str.split()
+                    for value in [value for value in ping_args if value.startswith('tcp:')]:
+                        ping_args.remove(value)
+                        args['method'], args['port'] = 'tcp', int(value[4:])
+                    hosts = [value for value in ping_args if not value.isdigit()]
+                    counts = [int(value) for value in ping_args if value.isdigit()]
+                    if len(hosts) > 1:
+                        args['hosts'] = hosts
+                    elif hosts:
+                        args['host'] = hosts[0]
+                    if counts:
+                        args['count'] = counts[0]
                 elif command == 'findfile':
                     find_args = args_str.split(' ', 1)
                     if find_args:
                         args['pattern'] = find_args[0]
+                        kind, sep, pattern = find_args[0].partition(':')
+                        if sep and kind in ('substring', 'prefix', 'glob', 'regex'):
+                            args['match'], args['pattern'] = kind, pattern
                         if len(find_args) > 1:
                             args['path'] = find_args[1]
+                elif command == 'listnext':
+                    if not self.list_cursor:
+                        print("[-] No listdir entries left to show")
+                        continue
+                    command = 'listdir'
+                    args['cursor'] = self.list_cursor
+                elif command == 'findnext':
+                    if not self.find_cursor:
+                        print("[-] No findfile results left to continue")
+                        continue
+                    command = 'findfile'
+                    args['cursor'] = self.find_cursor
+                elif command == 'batch':
+                    args['commands'] = [{'command': name} for name in args_str.split()]
+                    args['concurrent'] = True
+                
+                if command in self.COLUMNAR_COMMANDS:
+                    args['format'] = 'columns'
+                if command == 'findfile':
+                    self.display_find_stream(args)
+                    continue
                 
                 # Send command to server
                 response = self.send_command(command, args)
@@ -170,6 +381,8 @@ class RemoteCommandClient:
         """Display the response from the server"""
         if response.get('status') == 'error':
             print(f"[-] Error: {response.get('error', 'Unknown error')}")
+            if 'retry_after' in response:
+                print(f"[-] Retry in {response['retry_after']:.1f} seconds")
             return
             
         result = response.get('result')
@@ -186,13 +399,41 @@ class RemoteCommandClient:
             print(f"{'Type':<8} {'Size':<10} {'Modified':<22} {'Name'}")
             print("-" * 70)
             
-            for item in result:
-                item_type = "DIR" if item['is_dir'] else "FILE"
-                size = item['size'] if not item['is_dir'] else "-"
-                modified = datetime.datetime.fromtimestamp(item['modified']).strftime('%Y-%m-%d %H:%M:%S')
-                print(f"{item_type:<8} {size:<10} {modified:<22} {item['name']}")
+            count, columns = column_arrays(result)
+            missing = [None] * count
+            for is_dir, size, modified, name in zip(columns.get('is_dir', missing), columns.get('size', missing),
+                                                    columns.get('modified', missing), columns['name']):
+                item_type = "DIR" if is_dir else "FILE"
+                size = size if size is not None and not is_dir else "-"
+                modified = datetime.datetime.fromtimestamp(modified).strftime('%Y-%m-%d %H:%M:%S') if modified is not None else "-"
+                print(f"{item_type:<8} {size:<10} {modified:<22} {name}")
             print("=" * 70)
-            print(f"Total: {len(result)} items\n")
+            print(f"Total: {count} items")
+            self.list_cursor = response.get('cursor')
+            if self.list_cursor:
+                print("More entries available; type 'listnext' to continue")
+            print()
+            
+        elif command == 'du':
+            print(f"\n=== Disk Usage: {result.get('path')} ===")
+            print(f"Total: {self.format_size(result.get('size'))} in {result.get('files')} files, {result.get('dirs')} directories")
+            print(f"{'Size':<12} {'Files':<10} {'Directory'}")
+            print("-" * 70)
+            for item in result.get('top', []):
+                print(f"{self.format_size(item.get('size')):<12} {item.get('files'):<10} {item.get('path')}")
+            print("=" * 70)
+            print(f"Rescanned {result.get('scanned')} directories, reused {result.get('reused')} unchanged\n")
+            
+        elif command == 'diskspace' and isinstance(result, list):
+            print("\n=== Disk Space Information ===")
+            print(f"{'Mount':<30} {'Type':<8} {'Size':<12} {'Used':<12} {'Use%':<6} {'IUse%':<6}")
+            print("-" * 80)
+            for mount in result:
+                inodes = mount.get('inodes_percent_used')
+                inodes = f"{inodes:.0f}%" if inodes is not None else "-"
+                print(f"{mount['mountpoint']:<30} {mount['fstype']:<8} {self.format_size(mount['total']):<12} "
+                      f"{self.format_size(mount['used']):<12} {mount['percent_used']:.0f}%{'':<3} {inodes:<6}")
+            print("=" * 80 + "\n")
             
         elif command == 'diskspace':
             print("\n=== Disk Space Information ===")
@@ -203,13 +444,17 @@ class RemoteCommandClient:
             
         elif command == 'processlist':
             print("\n=== Process List ===")
-            print(f"{'PID':<7} {'User':<15} {'Memory %':<10} {'CPU %':<8} {'Created':<22} {'Name'}")
-            print("-" * 80)
+            print(f"{'PID':<7} {'User':<15} {'Memory %':<10} {'CPU %':<8} {'RSS':<12} {'Threads':<8} {'Created':<22} {'Name'}")
+            print("-" * 100)
             
-            for proc in result:
-                created = datetime.datetime.fromtimestamp(proc.get('create_time', 0)).strftime('%Y-%m-%d %H:%M:%S') if proc.get('create_time') else "-"
-                print(f"{proc.get('pid', '-'):<7} {proc.get('username', '-'):<15} {proc.get('memory_percent', 0):<10.1f} {proc.get('cpu_percent', 0):<8.1f} {created:<22} {proc.get('name', '-')}")
-            print("=" * 80 + "\n")
+            count, columns = column_arrays(result)
+            missing = [None] * count
+            for pid, username, memory, cpu, rss, threads, create_time, name in zip(
+                    *(columns.get(key, missing) for key in ('pid', 'username', 'memory_percent', 'cpu_percent',
+                                                             'rss', 'num_threads', 'create_time', 'name'))):
+                created = datetime.datetime.fromtimestamp(create_time).strftime('%Y-%m-%d %H:%M:%S') if create_time else "-"
+                print(f"{pid if pid is not None else '-':<7} {username or '-':<15} {memory or 0:<10.1f} {cpu or 0:<8.1f} {self.format_size(rss):<12} {threads or '-':<8} {created:<22} {name or '-'}")
+            print("=" * 100 + "\n")
             
         elif command == 'meminfo':
             print("\n=== Memory Information ===")
@@ -276,21 +521,80 @@ class RemoteCommandClient:
             print(f"\nServer echo: {result}\n")
             
         elif command == 'ping':
+            if isinstance(result, dict):
+                result = [result]
             print("\n=== Ping Results ===")
-            print(result)
-            print("===================\n")
+            print(f"{'Host':<30} {'Loss':<8} {'Min':<9} {'Avg':<9} {'Max':<9} {'Mdev':<9}")
+            print("-" * 78)
+            for probe in result:
+                if probe.get('received') is None:
+                    print(f"{probe.get('host'):<30} {probe.get('error', 'error')}")
+                    continue
+                stats = [f"{probe[key]:.3f}" if probe.get(key) is not None else "-" for key in ('min', 'avg', 'max', 'mdev')]
+                print(f"{probe.get('host'):<30} {str(probe.get('loss')) + '%':<8} " + " ".join(f"{value:<9}" for value in stats))
+            if len(result) == 1 and result[0].get('rtt'):
+                print("Replies (ms): " + ", ".join(f"{rtt:.3f}" for rtt in result[0]['rtt']))
+            print("=" * 78 + "\n")
             
         elif command == 'findfile':
             print(f"\n=== Find Results ===")
             print(f"Found {response.get('count', 0)} matches:")
-            for item in result:
-                item_type = "[DIR]" if item.get('is_dir') else "[FILE]"
-                print(f"{item_type} {item.get('path')}")
+            self._display_matches(result)
             print("===================\n")
             
+        elif command == 'refresh':
+            self.display_response('sysinfo', {'status': 'success', 'result': result['sysinfo']})
+            self.display_response('hostname', {'status': 'success', 'result': result['hostname']})
+            
+        elif command == 'stats':
+            print("\n=== Server Statistics ===")
+            for key, value in result.items():
+                print(f"{key}: {value}")
+            print("=========================\n")
+            
+        elif command == 'batch':
+            for entry, entry_response in zip(args.get('commands', []), result):
+                self.display_response(entry['command'], entry_response, entry.get('args'))
+            
         else:
             print(f"\nResult: {result}\n")
             
+    def display_find_stream(self, args):
+        """Stream findfile results, printing each chunk as soon as it arrives"""
+        print(f"\n=== Find Results ===")
+        chunks = self.stream_command('findfile', args)
+        try:
+            for chunk in chunks:
+                if not self._display_find_chunk(chunk):
+                    return
+        except KeyboardInterrupt:
+            # Stop the walk on the server, then skip what it sent before stopping
+            request_id = self.next_id
+            self.cancel(request_id)
+            while self._receive(request_id).get('more'):
+                pass
+            print("\n[!] Search cancelled")
+        print("===================\n")
+    
+    def _display_find_chunk(self, chunk):
+        """Print one streamed findfile chunk; False once the stream failed"""
+        if chunk.get('status') == 'error':
+            print(f"[-] Error: {chunk.get('error', 'Unknown error')}")
+            return False
+        self._display_matches(chunk.get('result', []))
+        if not chunk.get('more'):
+            print(f"Found {chunk.get('count', 0)} matches")
+            self.find_cursor = chunk.get('cursor')
+            if self.find_cursor:
+                print("More matches available; type 'findnext' to continue")
+        return True
+
+    def _display_matches(self, result):
+        """Print findfile matches, given as rows or columns"""
+        count, columns = column_arrays(result)
+        for path, is_dir in zip(columns.get('path', [None] * count), columns.get('is_dir', [None] * count)):
+            print(f"{'[DIR]' if is_dir else '[FILE]'} {path}")
+
     def format_size(self, size):
         """Format byte size to human-readable form"""
         if size is None:
@@ -306,9 +610,16 @@ if __name__ == "__main__":
     parser.add_argument("host", nargs='?', default='127.0.0.1', help="Target host to connect to")
     parser.add_argument("--port", type=int, default=9999, help="Target port to connect to")
     parser.add_argument("--token", default=os.environ.get('RCE_TOKEN'), help="Auth token (or set RCE_TOKEN env var)")
+    parser.add_argument("--max-frame-size", type=int, default=DEFAULT_MAX_FRAME_SIZE, help="Largest response frame accepted, in bytes")
+    parser.add_argument("--deadline", type=float, default=None, help="Seconds the server may spend on each request")
+    parser.add_argument("--encoding", choices=list(ENCODINGS), default='json', help="Message encoding to negotiate with the server")
+    parser.add_argument("--compression", choices=list(COMPRESSIONS), default=None, help="Compress large frames in both directions")
+    parser.add_argument("--heartbeat", type=float, default=60.0, help="Send a heartbeat after this many idle seconds (0 = never)")
     args = parser.parse_args()
     
-    client = RemoteCommandClient(args.host, args.port, token=args.token)
+    client = RemoteCommandClient(args.host, args.port, token=args.token, max_frame_size=args.max_frame_size,
+                                 deadline=args.deadline, encoding=args.encoding, compression=args.compression,
+                                 heartbeat=args.heartbeat)
     
     if client.connect():
         try:
@@ -0,0 +1,170 @@
+# diskusage.py
+"""Recursive disk usage (du) with per-directory results cached between runs.
+
+A directory's own usage (the files directly in it and the names of its
+subdirectories) only changes when its entries change, and that bumps the
+directory's mtime. Each directory's own usage is therefore cached under its
+inode and mtime: a repeat run stats every directory, but only lists and stats
+the contents of directories whose mtime moved. Subtree totals are summed from
+the per-directory figures on every run.
+
+Files with several hard links are counted once per run, like du does.
+Files that grow or shrink in place do not touch their directory's mtime, so
+cached entries also expire after max_age seconds; a growing log file is seen
+at the latest on the first run after that.
+"""
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class DiskUsageCache:
+    """Measures directory trees on an executor, reusing unchanged directories"""
+
+    def __init__(self, executor, max_outstanding=16, max_entries=1000000, max_age=300.0):
+        self.executor = executor
+        self.max_outstanding = max(1, max_outstanding)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def measure(self, root, top=10, one_filesystem=True, check=None, max_age=None):
+        """Usage of the tree under root with its top largest directories
+
+        Sizes are allocated bytes where the platform reports them (like du),
+        otherwise apparent sizes. Symlinks are not followed, and with
+        one_filesystem directories on other devices are skipped (like du -x).
+        check, if given, is called as directories complete and may raise to
+        abort the run; reads already submitted are then cancelled. Cached
+        directories older than max_age seconds (default: the cache's own
+        max_age; 0 rescans everything) are listed again.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        root = os.path.abspath(root)
+        root_dev = os.stat(root).st_dev if one_filesystem else None
+        own = {}
+        parents = {}
+        linked = set()
+        scanned = reused = 0
+
+        queue = deque([root])
+        pending = set()
+        while queue or pending:
+            while queue and len(pending) < self.max_outstanding:
+                pending.add(self.executor.submit(self._measure_dir, queue.popleft(), root_dev, max_age))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if check is not None:
+                try:
+                    check()
+                except BaseException:
+                    for future in pending:
+                        future.cancel()
+                    raise
+            for future in done:
+                path, usage, was_cached = future.result()
+                if usage is None:
+                    continue
+                size, files, subdirs, links = usage
+                for inode, link_size in links:
+                    if inode not in linked:
+                        linked.add(inode)
+                        size += link_size
+                own[path] = (size, files)
+                if was_cached:
+                    reused += 1
+                else:
+                    scanned += 1
+                for name in subdirs:
+                    child = os.path.join(path, name)
+                    parents[child] = path
+                    queue.append(child)
+
+        # Children are always longer paths than their parents, so summing
+        # deepest-first folds every subtree into its parent exactly once
+        totals = {path: list(usage) for path, usage in own.items()}
+        for path in sorted(totals, key=len, reverse=True):
+            parent = parents.get(path)
+            if parent is not None:
+                totals[parent][0] += totals[path][0]
+                totals[parent][1] += totals[path][1]
+
+        largest = heapq.nlargest(top, totals.items(), key=lambda item: item[1][0])
+        return {
+            'path': root,
+            'size': totals[root][0] if root in totals else 0,
+            'files': totals[root][1] if root in totals else 0,
+            'dirs': len(totals),
+            'scanned': scanned,
+            'reused': reused,
+            'top': [{'path': path, 'size': size, 'files': files} for path, (size, files) in largest]
+        }
+
+    def _measure_dir(self, path, root_dev, max_age=None):
+        """(path, usage or None, from cache)
+
+        usage is (own size, own file count, subdirectory names, hard-linked
+        files as (inode, size)); hard-linked files are left out of own size so
+        the caller can count each of them once.
+        """
+        try:
+            stats = os.stat(path, follow_symlinks=False)
+        except OSError:
+            return path, None, False
+        if root_dev is not None and stats.st_dev != root_dev:
+            return path, None, False
+
+        # The directory's own blocks are current from the stat above, like du counts them
+        own_size = _allocated(stats)
+        key = (stats.st_ino, stats.st_mtime_ns)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(path)
+            if (cached is not None and cached[0] == key
+                    and (max_age is None or max_age > 0 and now - cached[2] < max_age)):
+                self._entries.move_to_end(path)
+                size, files, subdirs, links = cached[1]
+                return path, (own_size + size, files, subdirs, links), True
+
+        size = files = 0
+        subdirs = []
+        links = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                            continue
+                        entry_stats = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    files += 1
+                    if entry_stats.st_nlink > 1:
+                        links.append((entry_stats.st_ino, _allocated(entry_stats)))
+                    else:
+                        size += _allocated(entry_stats)
+        except OSError:
+            return path, None, False
+
+        usage = (size, files, tuple(subdirs), tuple(links))
+        with self._lock:
+            self._entries[path] = (key, usage, now)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return path, (own_size + size, files, usage[2], usage[3]), False
+
+    def snapshot(self):
+        """Cache size, for reporting"""
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'max_age': self.max_age}
+
+
+def _allocated(stats):
+    """Bytes allocated on disk for a stat result (apparent size where blocks are not reported)"""
+    blocks = getattr(stats, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else stats.st_size
@@ -0,0 +1,558 @@
+# fileindex.py
+"""Persistent filename index used by findfile.
+
+Each configured root is walked in the background into a compact in-memory
+snapshot: every name lives in one newline-separated string, so a query is a
+single regex scan in C instead of a Python loop over millions of entries.
+Entries are stored in the same depth-first, name-ordered sequence that the
+live walk produces, which keeps findfile cursors valid across both.
+
+Changes are picked up through inotify (Linux only) and periodic rescans.
+Between rescans they are kept in a small overlay of added and removed paths
+that queries merge with the snapshot.
+
+A follower index does no scanning or watching of its own: it only loads the
+snapshots another process persists to the shared index directory, and
+reloads them whenever that process saves a new build.
+"""
+import ctypes
+import ctypes.util
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import select
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+QUERY_KINDS = ('substring', 'prefix', 'glob', 'regex')
+INDEX_FORMAT = b'RCEIDX1\n'
+
+# inotify event bits (see inotify(7))
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def compile_query(pattern, kind='substring'):
+    """Compile a filename query into a regex matched against one lower-cased name
+
+    The regex is also safe to run over a newline-separated list of names:
+    substring, prefix and glob queries never match across a newline.
+    """
+    if kind == 'substring':
+        return re.compile(re.escape(pattern.lower()))
+    if kind == 'prefix':
+        return re.compile('^' + re.escape(pattern.lower()), re.MULTILINE)
+    if kind == 'glob':
+        return re.compile('^' + _glob_to_regex(pattern.lower()) + '$', re.MULTILINE)
+    if kind == 'regex':
+        return re.compile(pattern, re.MULTILINE | re.IGNORECASE)
+    raise ValueError(f"Unknown match type: {kind}")
+
+
+def _glob_to_regex(pattern):
+    """Translate a shell glob into a regex that stays within a single line"""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '*':
+            parts.append('[^\n]*')
+        elif c == '?':
+            parts.append('[^\n]')
+        elif c == '[' and pattern.find(']', i + 2) != -1:
+            end = pattern.find(']', i + 2)
+            body = pattern[i + 1:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^\n' + body[1:]
+            parts.append('[' + body + ']')
+            i = end
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return ''.join(parts)
+
+
+class _Snapshot:
+    """Immutable index of one root as of its last full scan"""
+
+    def __init__(self, root, names, offsets, parents, is_dir, dir_parts, dir_ranges, built_at):
+        self.root = root
+        self.names = names
+        self.offsets = offsets
+        self.parents = parents
+        self.is_dir = is_dir
+        self.dir_parts = dir_parts
+        self.dir_ranges = dir_ranges
+        self.built_at = built_at
+        self.dir_ids = {parts: dir_id for dir_id, parts in enumerate(dir_parts)}
+        lower = names.lower()
+        if len(lower) != len(names):
+            # A few characters lower-case to longer strings; keep those names as they are
+            lower = ''.join(n if len(n.lower()) != len(n) else n.lower() for n in re.split('(\n)', names))
+        self.lower = lower
+
+    def __len__(self):
+        return len(self.parents)
+
+    def name(self, i):
+        return self.names[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def key(self, i):
+        """Path components of entry i relative to the root; sorts in walk order"""
+        return self.dir_parts[self.parents[i]] + (self.name(i),)
+
+    def path(self, i):
+        return os.path.join(self.root, *self.key(i))
+
+    def contains(self, parts):
+        """Whether the entry at the given relative path components is in the snapshot"""
+        if not parts:
+            return False
+        i = bisect_right(range(len(self)), parts, key=self.key) - 1
+        return i >= 0 and self.key(i) == parts
+
+    def subtree(self, parts):
+        """Entry index range [start, end) of everything below a directory"""
+        if not parts:
+            return 0, len(self)
+        dir_id = self.dir_ids.get(parts)
+        if dir_id is None:
+            return 0, 0
+        return self.dir_ranges[2 * dir_id], self.dir_ranges[2 * dir_id + 1]
+
+    def search(self, query, start, end, verify):
+        """Yield indices of entries in [start, end) whose name matches query"""
+        pos, endpos = self.offsets[start], self.offsets[end]
+        while pos < endpos:
+            match = query.search(self.lower, pos, endpos)
+            if match is None:
+                return
+            i = bisect_right(self.offsets, match.start(), start, end) - 1
+            pos = self.offsets[i + 1]
+            if verify and not query.search(self.lower[self.offsets[i]:pos - 1]):
+                continue
+            yield i
+
+    def save(self, path):
+        """Persist the snapshot atomically"""
+        dir_blob = '\0'.join('/'.join(parts) for parts in self.dir_parts)
+        sections = [
+            self.names.encode('utf-8', 'surrogateescape'),
+            self.offsets.tobytes(),
+            self.parents.tobytes(),
+            bytes(self.is_dir),
+            dir_blob.encode('utf-8', 'surrogateescape'),
+            self.dir_ranges.tobytes()
+        ]
+        header = {'root': self.root, 'built_at': self.built_at, 'sections': [len(s) for s in sections]}
+        # A temp file of its own, so a reader never sees a partly written index
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(INDEX_FORMAT)
+                f.write(json.dumps(header).encode('utf-8') + b'\n')
+                for section in sections:
+                    f.write(section)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def load(cls, path, root):
+        """Load a persisted snapshot of root, or None if missing or unusable"""
+        try:
+            with open(path, 'rb') as f:
+                if f.readline() != INDEX_FORMAT:
+                    return None
+                header = json.loads(f.readline())
+                if header['root'] != root:
+                    return None
+                sizes = header['sections']
+                if len(sizes) != 6:
+                    return None
+                sections = [f.read(size) for size in sizes]
+                if [len(section) for section in sections] != sizes or f.read(1):
+                    # Truncated, or written over by something else
+                    return None
+            names = sections[0].decode('utf-8', 'surrogateescape')
+            offsets, parents, dir_ranges = array('q'), array('i'), array('q')
+            offsets.frombytes(sections[1])
+            parents.frombytes(sections[2])
+            dir_ranges.frombytes(sections[5])
+            dir_blob = sections[4].decode('utf-8', 'surrogateescape')
+            dir_parts = [tuple(p.split('/')) if p else () for p in dir_blob.split('\0')]
+            if (len(offsets) != len(parents) + 1 or len(sections[3]) != len(parents)
+                    or len(dir_ranges) != 2 * len(dir_parts) or (len(offsets) and offsets[-1] != len(names))
+                    or (parents and (min(parents) < 0 or max(parents) >= len(dir_parts)))):
+                return None
+            return cls(root, names, offsets, parents, bytearray(sections[3]), dir_parts, dir_ranges, header['built_at'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+class _Inotify:
+    """Minimal ctypes binding to Linux inotify"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read_events(self):
+        """Return pending (wd, mask, name) events"""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileIndex:
+    """Background-maintained filename index over a set of root directories"""
+
+    def __init__(self, roots, index_dir=None, rescan_interval=3600.0, max_overlay=100000,
+                 follower=False, reload_interval=10.0):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.index_dir = index_dir
+        self.rescan_interval = rescan_interval
+        self.max_overlay = max_overlay
+        self.follower = follower
+        self.reload_interval = reload_interval
+        self.running = False
+        self._snapshots = {}
+        self._added = {root: {} for root in self.roots}
+        self._removed = {root: set() for root in self.roots}
+        self._journal = None
+        self._lock = threading.Lock()
+        self._rescan = threading.Event()
+        self._stopped = threading.Event()
+        self._inotify = None
+        self._watches = {}
+        self._watch_error = None
+        self._loaded_files = {}
+
+    def start(self):
+        """Load persisted snapshots, then build and watch (or follow the owner's saves) in background threads"""
+        for root in self.roots:
+            self._load(root)
+
+        if self.follower:
+            self.running = True
+            if self.index_dir:
+                threading.Thread(target=self._follow_loop, name='rce-file-index-follow', daemon=True).start()
+            return
+
+        if sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                self._watch_error = str(e)
+
+        self.running = True
+        threading.Thread(target=self._build_loop, name='rce-file-index', daemon=True).start()
+        if self._inotify is not None:
+            threading.Thread(target=self._watch_loop, name='rce-file-index-watch', daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self._stopped.set()
+        self._rescan.set()
+
+    def request_rescan(self):
+        self._rescan.set()
+
+    def _index_file(self, root):
+        digest = hashlib.sha1(root.encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+        return os.path.join(self.index_dir, f'{digest}.idx')
+
+    def _load(self, root):
+        """Load the persisted snapshot of root if it changed since the last load"""
+        if not self.index_dir:
+            return
+        path = self._index_file(root)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self._loaded_files.get(root) == identity:
+            return
+        snapshot = _Snapshot.load(path, root)
+        if snapshot is None:
+            return
+        self._loaded_files[root] = identity
+        with self._lock:
+            self._snapshots[root] = snapshot
+        logging.info(json.dumps({'event': 'file_index_loaded', 'root': root, 'entries': len(snapshot)}))
+
+    def _follow_loop(self):
+        while not self._stopped.wait(self.reload_interval):
+            for root in self.roots:
+                try:
+                    self._load(root)
+                except Exception as e:
+                    logging.error(json.dumps({'event': 'file_index_error', 'root': root, 'error': str(e)}))
+
+    def _root_of(self, path):
+        """The indexed root containing path (the most specific one), or None"""
+        best = None
+        for root in self.roots:
+            if (path == root or path.startswith(root.rstrip(os.sep) + os.sep)) and (best is None or len(root) > len(best)):
+                best = root
+        return best
+
+    def covers(self, path):
+        """Whether queries under path can be answered from the index"""
+        root = self._root_of(os.path.abspath(path))
+        return root is not None and root in self._snapshots
+
+    # Building
+
+    def _build_loop(self):
+        while self.running:
+            for root in self.roots:
+                if not self.running:
+                    return
+                try:
+                    self._build(root)
+                except Exception as e:
+                    logging.error(json.dumps({'event': 'file_index_error', 'root': root, 'error': str(e)}))
+            self._rescan.wait(self.rescan_interval)
+            self._rescan.clear()
+
+    def _build(self, root):
+        started = time.monotonic()
+        with self._lock:
+            # Changes seen while scanning are replayed on top of the new snapshot
+            self._journal = []
+
+        names, parents, is_dir = [], array('i'), bytearray()
+        dir_parts, dir_ranges = [()], array('q', [0, 0])
+
+        def visit(dir_id, directory, parts):
+            self._watch(directory)
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError:
+                return
+            for entry in entries:
+                if '\n' in entry.name:
+                    # Cannot be represented in the newline-separated name list
+                    continue
+                names.append(entry.name)
+                parents.append(dir_id)
+                is_dir.append(entry.is_dir())
+                if entry.is_dir(follow_symlinks=False):
+                    child_id = len(dir_parts)
+                    child_parts = parts + (entry.name,)
+                    dir_parts.append(child_parts)
+                    dir_ranges.extend((len(names), 0))
+                    visit(child_id, entry.path, child_parts)
+                    dir_ranges[2 * child_id + 1] = len(names)
+
+        visit(0, root, ())
+        dir_ranges[1] = len(names)
+
+        offsets = array('q', [0])
+        total = 0
+        for name in names:
+            total += len(name) + 1
+            offsets.append(total)
+        blob = '\n'.join(names) + '\n' if names else ''
+        snapshot = _Snapshot(root, blob, offsets, parents, is_dir, dir_parts, dir_ranges, time.time())
+
+        with self._lock:
+            journal, self._journal = self._journal, None
+            self._snapshots[root] = snapshot
+            self._added[root] = {}
+            self._removed[root] = set()
+            for created, path, path_is_dir in journal:
+                if self._root_of(path) == root:
+                    self._apply(root, created, path, path_is_dir)
+
+        if self.index_dir:
+            os.makedirs(self.index_dir, exist_ok=True)
+            snapshot.save(self._index_file(root))
+        logging.info(json.dumps({'event': 'file_index_built', 'root': root, 'entries': len(snapshot),
+                                 'seconds': round(time.monotonic() - started, 3)}))
+
+    # Watching
+
+    def _watch(self, directory):
+        if self._inotify is None or self._watch_error:
+            return
+        try:
+            self._watches[self._inotify.add_watch(directory)] = directory
+        except OSError as e:
+            # Usually fs.inotify.max_user_watches; periodic rescans still keep the index current
+            self._watch_error = str(e)
+            logging.warning(json.dumps({'event': 'file_index_watch_error', 'error': str(e)}))
+
+    def _watch_loop(self):
+        while self.running:
+            readable, _, _ = select.select([self._inotify.fd], [], [], 1.0)
+            if not readable:
+                continue
+            for wd, mask, name in self._inotify.read_events():
+                if mask & IN_Q_OVERFLOW:
+                    self.request_rescan()
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                if not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._on_created(path, bool(mask & IN_ISDIR))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._on_change(False, path, bool(mask & IN_ISDIR))
+        self._inotify.close()
+
+    def _on_created(self, path, path_is_dir):
+        self._on_change(True, path, path_is_dir)
+        if path_is_dir and not os.path.islink(path):
+            # Entries may have been created before the watch on the new directory existed
+            self._watch(path)
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        self._on_created(entry.path, entry.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def _on_change(self, created, path, path_is_dir):
+        root = self._root_of(path)
+        if root is None:
+            return
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((created, path, path_is_dir))
+            self._apply(root, created, path, path_is_dir)
+            overlay = len(self._added[root]) + len(self._removed[root])
+        if overlay > self.max_overlay:
+            self.request_rescan()
+
+    def _apply(self, root, created, path, path_is_dir):
+        """Record a change in the overlay of root (caller holds the lock)"""
+        snapshot = self._snapshots.get(root)
+        parts = tuple(os.path.relpath(path, root).split(os.sep))
+        added, removed = self._added[root], self._removed[root]
+        if created:
+            removed.discard(path)
+            if snapshot is None or not snapshot.contains(parts):
+                added[path] = path_is_dir
+        else:
+            added.pop(path, None)
+            if path_is_dir:
+                prefix = path + os.sep
+                for child in [p for p in added if p.startswith(prefix)]:
+                    del added[child]
+            if snapshot is not None and snapshot.contains(parts):
+                removed.add(path)
+
+    # Querying
+
+    def search(self, path, query, verify=False, after=()):
+        """Yield ({path, is_dir}, position) for entries under path whose name matches query
+
+        position is the tuple of names from path to the entry, in walk order;
+        after resumes right behind a previously yielded position.
+        """
+        directory = os.path.abspath(path)
+        root = self._root_of(directory)
+        with self._lock:
+            snapshot = self._snapshots[root]
+            added = list(self._added[root].items())
+            removed = set(self._removed[root])
+
+        base_parts = tuple(os.path.relpath(directory, root).split(os.sep)) if directory != root else ()
+        after = tuple(after)
+        start, end = snapshot.subtree(base_parts)
+        if after:
+            start = bisect_right(range(start, end), base_parts + after, key=snapshot.key) + start
+
+        def from_snapshot():
+            for i in snapshot.search(query, start, end, verify):
+                entry_path = snapshot.path(i)
+                if removed and self._is_removed(entry_path, root, removed):
+                    continue
+                yield snapshot.key(i)[len(base_parts):], entry_path, bool(snapshot.is_dir[i])
+
+        prefix = directory.rstrip(os.sep) + os.sep
+        from_overlay = sorted(
+            (tuple(os.path.relpath(entry_path, directory).split(os.sep)), entry_path, entry_is_dir)
+            for entry_path, entry_is_dir in added
+            if entry_path.startswith(prefix) and query.search(os.path.basename(entry_path).lower())
+        )
+        from_overlay = [item for item in from_overlay if item[0] > after]
+
+        for position, entry_path, entry_is_dir in heapq.merge(from_snapshot(), from_overlay):
+            yield {'path': os.path.join(path, *position), 'is_dir': entry_is_dir}, position
+
+    @staticmethod
+    def _is_removed(path, root, removed):
+        while len(path) > len(root):
+            if path in removed:
+                return True
+            path = os.path.dirname(path)
+        return False
+
+    def status(self):
+        """Per-root index size and freshness, for reporting"""
+        with self._lock:
+            roots = {
+                root: {
+                    'ready': root in self._snapshots,
+                    'entries': len(self._snapshots[root]) if root in self._snapshots else 0,
+                    'built_at': self._snapshots[root].built_at if root in self._snapshots else None,
+                    'overlay_added': len(self._added[root]),
+                    'overlay_removed': len(self._removed[root])
+                }
+                for root in self.roots
+            }
+        return {'roots': roots, 'follower': self.follower, 'watches': len(self._watches),
+                'watch_error': self._watch_error}
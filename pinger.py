@@ -0,0 +1,174 @@
+# pinger.py
+"""Concurrent ping used by the ping command.
+
+ICMP probes run the system ping binary as an asyncio subprocess, so probing
+many hosts takes about as long as probing one. The textual output of the
+Linux (iputils and BusyBox), BSD/macOS and Windows ping is parsed into
+numbers. TCP probes time a connect() to a port instead, which needs neither
+the ping binary nor a process per probe.
+
+Every result has the same shape: packet counts, loss percentage, min/avg/
+max/mdev in milliseconds, and the individual replies as two parallel arrays,
+seq (probe sequence numbers) and rtt (round-trip times).
+"""
+import asyncio
+import math
+import platform
+import re
+import socket
+import time
+
+TRANSMITTED = re.compile(r'(\d+) packets transmitted, (\d+) (?:packets )?received')
+WINDOWS_COUNTS = re.compile(r'Sent = (\d+), Received = (\d+)')
+RTT_SUMMARY = re.compile(r'= ([\d.]+)/([\d.]+)/([\d.]+)(?:/([\d.]+))? ms')
+WINDOWS_RTT = re.compile(r'Minimum = (\d+)ms, Maximum = (\d+)ms, Average = (\d+)ms')
+REPLY = re.compile(r'^.*?(?:(?:icmp_)?seq=(\d+).*?)?time([=<])([\d.]+) ?ms(?!.*DUP!)', re.MULTILINE)
+METHODS = ('icmp', 'tcp')
+
+
+def ping_command(host, count, timeout):
+    """Argument list for the system ping; timeout bounds the whole run in seconds"""
+    system = platform.system().lower()
+    if system == 'windows':
+        # Windows has no overall deadline, only a per-reply wait in milliseconds
+        return ['ping', '-n', str(count), '-w', str(int(timeout * 1000)), host]
+    if system == 'linux':
+        return ['ping', '-n', '-c', str(count), '-w', str(max(1, int(timeout))), host]
+    return ['ping', '-n', '-c', str(count), '-t', str(max(1, int(timeout))), host]
+
+
+def parse_ping_output(text):
+    """Packet counts, loss percentage, round-trip statistics and replies (ms) from ping output"""
+    result = {'transmitted': None, 'received': None, 'loss': None,
+              'min': None, 'avg': None, 'max': None, 'mdev': None, 'seq': [], 'rtt': []}
+    for number, reply in enumerate(REPLY.finditer(text), 1):
+        seq, comparison, rtt = reply.groups()
+        # Windows numbers no replies; count them instead so the arrays stay parallel
+        result['seq'].append(int(seq) if seq is not None else number)
+        # Windows reports sub-millisecond replies as time<1ms, recorded as 0 like its own summary does
+        result['rtt'].append(0.0 if comparison == '<' else float(rtt))
+    counts = TRANSMITTED.search(text) or WINDOWS_COUNTS.search(text)
+    if counts:
+        transmitted, received = int(counts.group(1)), int(counts.group(2))
+        result['transmitted'] = transmitted
+        result['received'] = received
+        result['loss'] = round(100.0 * (transmitted - received) / transmitted, 1) if transmitted else None
+    rtt = RTT_SUMMARY.search(text)
+    if rtt:
+        result['min'], result['avg'], result['max'] = (float(value) for value in rtt.group(1, 2, 3))
+        if rtt.group(4) is not None:
+            result['mdev'] = float(rtt.group(4))
+    else:
+        rtt = WINDOWS_RTT.search(text)
+        if rtt:
+            result['min'], result['max'], result['avg'] = (float(value) for value in rtt.group(1, 2, 3))
+    if result['mdev'] is None and result['rtt']:
+        # Windows and BusyBox leave the deviation out; derive it from the replies
+        result['mdev'] = _summarize(result['rtt'])['mdev']
+    return result
+
+
+def _summarize(rtts):
+    """min/avg/max/mdev of round-trip times, with mdev computed the way iputils does"""
+    if not rtts:
+        return {'min': None, 'avg': None, 'max': None, 'mdev': None}
+    avg = sum(rtts) / len(rtts)
+    variance = max(0.0, sum(rtt * rtt for rtt in rtts) / len(rtts) - avg * avg)
+    return {'min': min(rtts), 'avg': round(avg, 3), 'max': max(rtts), 'mdev': round(math.sqrt(variance), 3)}
+
+
+async def ping(host, count=4, timeout=None, method='icmp', port=80, interval=1.0):
+    """Probe one host and return its parsed result"""
+    timeout = timeout if timeout is not None else count + 5
+    if method == 'tcp':
+        return await tcp_ping(host, port, count, timeout, interval)
+    result = {'host': host}
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *ping_command(host, count, timeout),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    except OSError as e:
+        return {**result, 'status': 'error', 'error': str(e)}
+
+    try:
+        # The ping deadline normally ends the run first; this is the backstop
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout + 2)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return {**result, 'status': 'error', 'error': f"Timed out after {timeout} seconds"}
+    except asyncio.CancelledError:
+        # Abandoned by the caller; do not leave the ping running
+        process.kill()
+        await process.wait()
+        raise
+
+    parsed = parse_ping_output(stdout.decode(errors='replace'))
+    # Partial loss still makes ping exit non-zero on some platforms; any reply means the host is up
+    if parsed['received']:
+        result['status'] = 'success'
+    else:
+        result['status'] = 'error'
+        result['error'] = stderr.decode(errors='replace').strip() or 'No reply'
+    result.update(parsed)
+    return result
+
+
+async def tcp_ping(host, port=80, count=4, timeout=None, interval=1.0):
+    """Time count TCP connects to host:port, interval seconds apart, within timeout seconds overall"""
+    timeout = timeout if timeout is not None else count + 5
+    result = {'host': host, 'port': port}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        # Resolve once so that every probe times the connect alone
+        addresses = await asyncio.wait_for(loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        return {**result, 'status': 'error', 'error': str(e) or 'Name resolution timed out'}
+    family, _, _, _, address = addresses[0]
+
+    seqs, rtts = [], []
+    error = None
+    sent = 0
+    for seq in range(1, count + 1):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        sent += 1
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, address), remaining)
+            seqs.append(seq)
+            rtts.append(round((time.perf_counter() - started) * 1000, 3))
+        except (OSError, asyncio.TimeoutError) as e:
+            error = str(e) or 'Connect timed out'
+        finally:
+            sock.close()
+        if seq < count:
+            await asyncio.sleep(max(0.0, min(interval, deadline - loop.time())))
+
+    result['status'] = 'success' if rtts else 'error'
+    if not rtts:
+        result['error'] = error or 'No reply'
+    result.update({
+        'transmitted': sent,
+        'received': len(rtts),
+        'loss': round(100.0 * (sent - len(rtts)) / sent, 1) if sent else None,
+        **_summarize(rtts),
+        'seq': seqs,
+        'rtt': rtts
+    })
+    return result
+
+
+async def ping_many(hosts, count=4, timeout=None, concurrency=256, method='icmp', port=80, interval=1.0):
+    """Ping hosts concurrently, at most concurrency at a time; results are in input order"""
+    slots = asyncio.Semaphore(concurrency)
+
+    async def bounded(host):
+        async with slots:
+            return await ping(host, count, timeout, method, port, interval)
+
+    return await asyncio.gather(*(bounded(host) for host in hosts))
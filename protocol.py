@@ -0,0 +1,254 @@
+# protocol.py
+"""Wire protocol shared by the server and client.
+
+Every message is a frame: a 4-byte big-endian length header followed by that
+many bytes of encoded message. Messages are UTF-8 encoded JSON unless the
+client negotiated another encoding with a hello request (see ENCODINGS).
+
+When the server requires a token, a connection proves it knows the token
+once, by answering the challenge in the hello response (see auth_proof).
+
+A hello may also turn on compression (see COMPRESSIONS). The top bit of the
+length header then marks frames whose body is compressed; bodies smaller than
+the connection's threshold are still sent as they are.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import struct
+import zlib
+
+import binarycodec
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+HEADER = struct.Struct('!I')
+COMPRESSED_FLAG = 0x80000000
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024 * 1024
+DEFAULT_COMPRESS_THRESHOLD = 1024
+RECV_SIZE = 256 * 1024
+
+
+def _json_dumps(message):
+    return json.dumps(message).encode('utf-8')
+
+
+def _json_loads(body):
+    return json.loads(body.decode('utf-8'))
+
+
+# Message encodings by name, as (encode, decode); a connection starts out as json
+ENCODINGS = {
+    'json': (_json_dumps, _json_loads),
+    'msgpack': (binarycodec.packb, binarycodec.unpackb),
+}
+
+
+class FrameError(Exception):
+    """Raised when a peer sends a malformed or oversized frame"""
+
+
+class ZlibCompression:
+    """Deflate with one stream per direction for the life of the connection
+
+    Each compressed frame is flushed with Z_SYNC_FLUSH, so it can be inflated
+    as soon as it arrives, yet still refers back to everything compressed
+    before it on the connection. The chunks of a streamed response, which
+    repeat each other's paths and keys, compress far better this way than one
+    by one. Frames must therefore be compressed in the order they are sent
+    and decompressed in the order they arrive.
+    """
+
+    name = 'zlib'
+
+    def __init__(self, threshold=DEFAULT_COMPRESS_THRESHOLD, level=6):
+        self.threshold = threshold
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self._compressor = zlib.compressobj(level)
+        self._decompressor = zlib.decompressobj()
+
+    def compress(self, body):
+        data = self._compressor.compress(body) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.raw_bytes += len(body)
+        self.compressed_bytes += len(data)
+        return data
+
+    def decompress(self, data, max_size):
+        try:
+            body = self._decompressor.decompress(data, max_size)
+        except zlib.error as e:
+            raise FrameError(f"Corrupt compressed frame: {e}")
+        if self._decompressor.unconsumed_tail:
+            raise FrameError(f"Compressed frame inflates past maximum of {max_size} bytes")
+        return body
+
+
+class Lz4Compression:
+    """LZ4 frames compressed independently: less saving than zlib, much less CPU"""
+
+    name = 'lz4'
+
+    def __init__(self, threshold=DEFAULT_COMPRESS_THRESHOLD):
+        self.threshold = threshold
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def compress(self, body):
+        data = lz4.frame.compress(body, store_size=True)
+        self.raw_bytes += len(body)
+        self.compressed_bytes += len(data)
+        return data
+
+    def decompress(self, data, max_size):
+        try:
+            size = lz4.frame.get_frame_info(data).get('content_size') or 0
+            if not 0 < size <= max_size:
+                raise FrameError(f"Compressed frame of {size} bytes exceeds maximum of {max_size}")
+            return lz4.frame.decompress(data)
+        except RuntimeError as e:
+            raise FrameError(f"Corrupt compressed frame: {e}")
+
+
+# Compressions available here, fastest first; lz4 needs the lz4 package
+COMPRESSIONS = {'zlib': ZlibCompression}
+if lz4 is not None:
+    COMPRESSIONS = {'lz4': Lz4Compression, **COMPRESSIONS}
+
+
+def auth_proof(token, role, challenge, nonce):
+    """HMAC-SHA256 (hex) proving knowledge of token for one handshake
+
+    The client answers the server's challenge with role 'client' and a nonce
+    of its own; the server answers back with role 'server', so each side
+    knows the other holds the token without it ever crossing the wire.
+    """
+    message = f"{role}:{challenge}:{nonce}".encode('utf-8')
+    return hmac.new(token.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def encode_message(message, encoding='json', compression=None):
+    """Serialize a message into a complete frame, compressing it if it is large enough"""
+    body = ENCODINGS[encoding][0](message)
+    if compression is not None and len(body) >= compression.threshold:
+        body = compression.compress(body)
+        return HEADER.pack(len(body) | COMPRESSED_FLAG) + body
+    return HEADER.pack(len(body)) + body
+
+
+def decode_message(body, encoding='json'):
+    """Deserialize the body of a frame; raises ValueError if it is malformed"""
+    return ENCODINGS[encoding][1](body)
+
+
+def _frame_length(header, compression, max_frame_size):
+    """(body length, whether it is compressed) from a frame header"""
+    (length,) = HEADER.unpack(header)
+    compressed = bool(length & COMPRESSED_FLAG)
+    length &= ~COMPRESSED_FLAG
+    if compressed and compression is None:
+        raise FrameError("Compressed frame received before compression was negotiated")
+    if length > max_frame_size:
+        raise FrameError(f"Frame of {length} bytes exceeds maximum of {max_frame_size}")
+    return length, compressed
+
+
+class FrameReader:
+    """Incrementally reassemble frames from arbitrarily split socket reads"""
+
+    def __init__(self, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        # Set once the connection negotiates compression
+        self.compression = None
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Append received bytes to the internal buffer"""
+        self._buffer += data
+
+    def next_frame(self):
+        """Return the next complete frame body, or None if more data is needed"""
+        if len(self._buffer) < HEADER.size:
+            return None
+        length, compressed = _frame_length(self._buffer[:HEADER.size], self.compression, self.max_frame_size)
+        end = HEADER.size + length
+        if len(self._buffer) < end:
+            return None
+        body = bytes(self._buffer[HEADER.size:end])
+        del self._buffer[:end]
+        if compressed:
+            return self.compression.decompress(body, self.max_frame_size)
+        return body
+
+    def recv_frame(self, sock):
+        """Block until a full frame body is available on sock; None on clean EOF"""
+        while True:
+            body = self.next_frame()
+            if body is not None:
+                return body
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                if self._buffer:
+                    raise FrameError("Connection closed mid-frame")
+                return None
+            self.feed(data)
+
+
+async def read_frame(reader, max_frame_size=DEFAULT_MAX_FRAME_SIZE, compression=None):
+    """Read one frame body from an asyncio StreamReader; None on clean EOF"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise FrameError("Connection closed mid-frame")
+        return None
+    length, compressed = _frame_length(header, compression, max_frame_size)
+    try:
+        body = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise FrameError("Connection closed mid-frame")
+    if compressed:
+        return compression.decompress(body, max_frame_size)
+    return body
+
+
+def pack_columns(rows, time_columns=()):
+    """Columnar form of a list of uniform dicts: each key once, with its values in one array
+
+    The columns are the keys of the first row. Columns named in time_columns
+    hold epoch seconds; they are sent as integer milliseconds after a base
+    second, recorded under time_columns in the result.
+    """
+    columns = list(rows[0]) if rows else []
+    values = [[row.get(name) for row in rows] for name in columns]
+    bases = {}
+    for name in time_columns:
+        if name not in columns:
+            continue
+        index = columns.index(name)
+        present = [value for value in values[index] if value is not None]
+        base = int(min(present)) if present else 0
+        values[index] = [round((value - base) * 1000) if value is not None else None for value in values[index]]
+        bases[name] = base
+    return {'columns': columns, 'values': values, 'count': len(rows), 'time_columns': bases}
+
+
+def column_arrays(result):
+    """(row count, {column: values}) for a result in row or columnar form, with times in epoch seconds"""
+    if isinstance(result, dict) and 'columns' in result:
+        arrays = dict(zip(result['columns'], result['values']))
+        for name, base in result.get('time_columns', {}).items():
+            arrays[name] = [base + value / 1000 if value is not None else None for value in arrays[name]]
+        return result['count'], arrays
+    columns = list(dict.fromkeys(name for row in result for name in row))
+    return len(result), {name: [row.get(name) for row in result] for name in columns}
+
+
+def unpack_columns(result):
+    """Rows (a list of dicts) of a result in row or columnar form"""
+    _, arrays = column_arrays(result)
+    return [dict(zip(arrays, values)) for values in zip(*arrays.values())]
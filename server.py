@@ -1,30 +1,683 @@
 # server.py
 import socket
-import subprocess
 import threading
 import os
 import platform
 import json
+import re
 import argparse
 import shutil
+import fnmatch
 import psutil
 import logging
 import time
+import asyncio
+import base64
+import heapq
+import multiprocessing
+import signal
+import contextvars
+import hmac
+import secrets
+import stat
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from fileindex import QUERY_KINDS, FileIndex, compile_query
+import pinger
+from diskusage import DiskUsageCache
+from walker import ParallelWalker
+from protocol import (COMPRESSIONS, DEFAULT_COMPRESS_THRESHOLD, DEFAULT_MAX_FRAME_SIZE, ENCODINGS, FrameError, FrameReader,
+                      auth_proof, decode_message, encode_message, pack_columns, read_frame)
+
+class ClientConnection:
+    """Book-keeping for one connected client"""
+    
+    def __init__(self, address, handler=None):
+        self.address = address
+        self.handler = handler
+        self.connected_at = time.monotonic()
+        self.last_active = self.connected_at
+        self.in_flight = 0
+        self.closing = False
+        # Message encoding and compression chosen by the client's hello
+        self.encoding = 'json'
+        self.compression = None
+        # Set once the client answers a hello challenge; requests then need no token
+        self.authenticated = False
+        self.challenge = None
+        # Cancellable pipelined requests by request ID
+        self.requests = {}
+        self._lock = threading.Lock()
+    
+    def touch(self):
+        """Record that a frame arrived from the client"""
+        self.last_active = time.monotonic()
+    
+    def begin_request(self):
+        with self._lock:
+            self.in_flight += 1
+            self.last_active = time.monotonic()
+    
+    def end_request(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.last_active = time.monotonic()
+    
+    @property
+    def idle(self):
+        return self.in_flight == 0
+
+
+class RequestCancelled(BaseException):
+    """Raised inside a handler whose request was cancelled or ran past its deadline
+    
+    Derives from BaseException so the handlers' catch-all error handling lets
+    it through to handle_request, like asyncio.CancelledError.
+    """
+    
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+    
+    def response(self):
+        return {'status': 'error', 'error': str(self), 'code': self.code}
+
+
+class RequestContext:
+    """Cancellation state and deadline of one request
+    
+    Long-running handlers call check() in their loops; it raises
+    RequestCancelled once the client cancelled the request, went away, or the
+    deadline passed.
+    """
+    
+    def __init__(self, stats=None):
+        self.received_at = time.monotonic()
+        self.deadline = None
+        self.timeout = None
+        self.cancelled = False
+        self.stats = stats
+        self._counted = False
+    
+    def limit(self, timeout):
+        """Give the request timeout seconds from when it was received"""
+        self.timeout = timeout
+        self.deadline = self.received_at + timeout
+    
+    def cancel(self):
+        self.cancelled = True
+    
+    @property
+    def stopped(self):
+        return self.cancelled or (self.deadline is not None and time.monotonic() >= self.deadline)
+    
+    def check(self):
+        if not self.stopped:
+            return
+        if self.cancelled:
+            error = RequestCancelled('Request cancelled', 'cancelled')
+        else:
+            error = RequestCancelled(f"Request timed out after {self.timeout:g} seconds", 'timeout')
+        if self.stats is not None and not self._counted:
+            self._counted = True
+            self.stats[error.code] += 1
+        raise error
+
+
+# The request being handled on the current thread (or asyncio task)
+_current_request = contextvars.ContextVar('current_request', default=None)
+
+
+def current_request():
+    """Context of the request being handled; a never-cancelled one outside of requests"""
+    return _current_request.get() or RequestContext()
+
+
+async def run_cancellable(coroutine, request, poll_interval=0.1):
+    """Await coroutine, cancelling it (and killing what it runs) once request is stopped"""
+    task = asyncio.ensure_future(coroutine)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=poll_interval)
+        if done:
+            return task.result()
+        if request.stopped:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            request.check()
+
+
+class StreamingResponse:
+    """Handler result whose chunks are sent as separate frames sharing the request ID
+    
+    Each chunk is a complete response dict; the last one has 'more' set to False.
+    """
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+    
+    def __iter__(self):
+        # A failure mid-stream still ends the stream with a well-formed final chunk
+        try:
+            yield from self.chunks
+        except RequestCancelled as e:
+            yield {**e.response(), 'more': False}
+        except Exception as e:
+            yield {'status': 'error', 'error': str(e), 'more': False}
+    
+    def with_id(self, request_id):
+        return StreamingResponse({**chunk, 'id': request_id} for chunk in self)
+
+
+class StreamChannel:
+    """Hands the chunks of a stream produced on a lane thread to the event loop
+    
+    The producer may run at most capacity chunks ahead of the writer, so a
+    slow client holds back the walk instead of buffering it. Once the writer
+    closes the channel, put() returns False and the producer stops.
+    """
+    
+    def __init__(self, loop, capacity=4):
+        self._loop = loop
+        self._chunks = asyncio.Queue()
+        self._credits = threading.Semaphore(capacity)
+        self.closed = False
+    
+    def put(self, chunk):
+        """Queue a chunk from the producer thread, waiting for room; False once the writer is gone"""
+        self._credits.acquire()
+        if self.closed:
+            return False
+        self._loop.call_soon_threadsafe(self._chunks.put_nowait, chunk)
+        return True
+    
+    def finish(self):
+        """Mark the end of the stream, from the producer thread"""
+        self._loop.call_soon_threadsafe(self._chunks.put_nowait, None)
+    
+    async def get(self):
+        """Next chunk, or None at the end of the stream"""
+        chunk = await self._chunks.get()
+        if chunk is not None:
+            self._credits.release()
+        return chunk
+    
+    def close(self):
+        """Stop the producer, from the event loop"""
+        self.closed = True
+        # Wakes a producer waiting for room; it then sees closed
+        self._credits.release()
+
+
+class Lane:
+    """Executor for one class of commands with a bounded queue and depth metrics
+    
+    At most workers requests of the lane run at once and at most max_queue
+    more wait for a worker; submit() refuses anything beyond that, so a burst
+    of heavy requests cannot build an unbounded backlog.
+    """
+    
+    def __init__(self, name, workers=None, max_queue=256):
+        self.name = name
+        # Same default as ThreadPoolExecutor
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f'rce-{name}')
+        self.max_queue = max_queue
+        self.stats = {'running': 0, 'queued': 0, 'peak_queued': 0, 'completed': 0, 'rejected': 0}
+        self._wait_total = 0.0
+        self._lock = threading.Lock()
+    
+    def submit(self, fn, *args):
+        """Schedule fn(*args) on the lane; None if the lane's queue is full"""
+        with self._lock:
+            if self.stats['running'] + self.stats['queued'] >= self.workers + self.max_queue:
+                self.stats['rejected'] += 1
+                return None
+            self.stats['queued'] += 1
+            self.stats['peak_queued'] = max(self.stats['peak_queued'], self.stats['queued'])
+        return self.executor.submit(self._run, time.monotonic(), fn, *args)
+    
+    def _run(self, queued_at, fn, *args):
+        with self._lock:
+            self.stats['queued'] -= 1
+            self.stats['running'] += 1
+            self._wait_total += time.monotonic() - queued_at
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.stats['running'] -= 1
+                self.stats['completed'] += 1
+    
+    def snapshot(self):
+        """Counters plus limits and mean queue wait, for reporting"""
+        with self._lock:
+            started = self.stats['completed'] + self.stats['running']
+            return {**self.stats, 'workers': self.workers, 'max_queue': self.max_queue,
+                    'avg_wait_ms': round(1000 * self._wait_total / started, 3) if started else 0.0}
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RateLimiter:
+    """Token buckets keyed by client, such as its IP address
+    
+    Every bucket holds up to burst tokens and refills at rate tokens per
+    second; a request is let through only if all of its buckets can pay its
+    cost. Buckets that have refilled completely are forgotten once more than
+    max_keys are tracked.
+    """
+    
+    def __init__(self, rate, burst=None, max_keys=100000):
+        self.rate = rate
+        self.burst = burst or 2 * rate
+        self.max_keys = max_keys
+        self.throttled = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, keys, cost):
+        """Charge cost to every bucket in keys; 0 if allowed, else seconds until it would be"""
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key in keys:
+                tokens, updated = self._buckets.get(key, (self.burst, now))
+                levels.append(min(self.burst, tokens + (now - updated) * self.rate))
+            short = max(cost - level for level in levels)
+            if short > 0:
+                self.throttled += 1
+                return short / self.rate
+            for key, level in zip(keys, levels):
+                self._buckets[key] = (level - cost, now)
+            if len(self._buckets) > self.max_keys:
+                self._forget_full(now)
+            return 0
+    
+    def _forget_full(self, now):
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) * self.rate >= self.burst:
+                del self._buckets[key]
+    
+    def snapshot(self):
+        """Limits, tracked buckets and requests refused, for reporting"""
+        with self._lock:
+            return {'rate': self.rate, 'burst': self.burst, 'keys': len(self._buckets), 'throttled': self.throttled}
+
+
+class ResultCache:
+    """Size-bounded LRU cache of command responses with per-command TTLs
+    
+    Concurrent identical requests are coalesced: the first caller computes the
+    response while the others wait for it (single-flight).
+    """
+    
+    def __init__(self, ttls, max_entries=1024):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+    
+    @staticmethod
+    def make_key(command, args):
+        """Key a request by command name and its arguments in canonical form"""
+        return command + '\0' + json.dumps(args, sort_keys=True, separators=(',', ':'))
+    
+    def get_or_compute(self, command, args, compute):
+        """Return a fresh cached response for (command, args) or compute and cache one"""
+        ttl = self.ttls.get(command)
+        if not ttl:
+            return compute(args)
+        
+        key = self.make_key(command, args)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        
+        if not owner:
+            try:
+                return future.result()
+            except RequestCancelled:
+                # The computing request was abandoned; that says nothing about this one
+                return self.get_or_compute(command, args, compute)
+        
+        try:
+            response = compute(args)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        
+        with self._lock:
+            del self._loading[key]
+            # Errors are cheap to recompute and often transient, so only cache successes
+            if response.get('status') == 'success':
+                self._entries[key] = (time.monotonic() + ttl, response)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+        future.set_result(response)
+        return response
+    
+    def snapshot(self):
+        """Counters plus current size, for reporting"""
+        with self._lock:
+            return {**self.stats, 'entries': len(self._entries)}
+
+
+class ListingSnapshots:
+    """Sorted remainders of paginated directory listings, so later pages need not rescan
+    
+    Holds at most max_entries keys across all snapshots, each for ttl seconds;
+    the oldest snapshots are dropped first.
+    """
+    
+    def __init__(self, max_entries=2000000, ttl=120.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._snapshots = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {'stored': 0, 'hits': 0, 'misses': 0}
+    
+    def store(self, keys):
+        """Remember a sorted key list; its token, or None if it does not fit"""
+        if len(keys) > self.max_entries:
+            return None
+        token = secrets.token_hex(8)
+        with self._lock:
+            self._expire(time.monotonic())
+            while self._snapshots and self._size + len(keys) > self.max_entries:
+                _, (_, dropped) = self._snapshots.popitem(last=False)
+                self._size -= len(dropped)
+            self._snapshots[token] = (time.monotonic() + self.ttl, keys)
+            self._size += len(keys)
+            self.stats['stored'] += 1
+        return token
+    
+    def get(self, token):
+        """The keys stored under token, or None once dropped"""
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._snapshots.get(token)
+            self.stats['hits' if entry is not None else 'misses'] += 1
+            return entry[1] if entry is not None else None
+    
+    def _expire(self, now):
+        while self._snapshots:
+            token, (expires, keys) = next(iter(self._snapshots.items()))
+            if expires > now:
+                break
+            del self._snapshots[token]
+            self._size -= len(keys)
+    
+    def snapshot(self):
+        """Counters plus current size, for reporting"""
+        with self._lock:
+            return {**self.stats, 'snapshots': len(self._snapshots), 'keys': self._size,
+                    'max_entries': self.max_entries}
+
+
+class ProcessSampler:
+    """Background thread keeping a process table with real per-process CPU usage
+    
+    Process objects persist between samples, so cpu_percent() measures the
+    delta since the previous sample instead of always returning 0.0. The top
+    rows for each sort key are precomputed once per sample, making queries a
+    slice of a ready-made list.
+    """
+    
+    SORT_KEYS = ('memory_percent', 'cpu_percent', 'rss', 'num_threads')
+    
+    def __init__(self, interval=2.0, precomputed_top=256):
+        self.interval = interval
+        self.precomputed_top = precomputed_top
+        self.running = False
+        self.sampled_at = None
+        self._procs = {}
+        self._static = {}
+        self._rows = []
+        self._top = {key: [] for key in self.SORT_KEYS}
+        self._stopped = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Take an initial sample and keep sampling in a daemon thread"""
+        self.sample()
+        self.running = True
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='rce-process-sampler', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self.running = False
+        self._stopped.set()
+    
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error(json.dumps({'event': 'process_sample_error', 'error': str(e)}))
+    
+    def sample(self):
+        """Refresh the process table"""
+        total_memory = psutil.virtual_memory().total
+        procs = {}
+        rows = []
+        for pid in psutil.pids():
+            proc = self._procs.get(pid)
+            try:
+                # is_running() also compares the start time, catching a pid reused by a new process
+                if proc is not None and not proc.is_running():
+                    proc = None
+                    self._static.pop(pid, None)
+                if proc is None:
+                    proc = psutil.Process(pid)
+                with proc.oneshot():
+                    # Name, owner and start time never change for a given process
+                    static = self._static.get(pid)
+                    if static is None:
+                        static = proc.as_dict(['name', 'username', 'create_time'], ad_value=None)
+                    rss = proc.memory_info().rss
+                    row = {
+                        'pid': pid,
+                        'name': static['name'],
+                        'username': static['username'],
+                        'memory_percent': rss / total_memory * 100,
+                        'cpu_percent': proc.cpu_percent(),
+                        'create_time': static['create_time'],
+                        'rss': rss,
+                        'num_threads': proc.num_threads()
+                    }
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                continue
+            except psutil.AccessDenied:
+                row = {'pid': pid, 'name': None, 'username': None, 'memory_percent': 0.0,
+                       'cpu_percent': 0.0, 'create_time': None, 'rss': 0, 'num_threads': 0}
+                static = None
+            procs[pid] = proc
+            if static is not None:
+                self._static[pid] = static
+            rows.append(row)
+        
+        # Forget processes that have exited
+        self._static = {pid: self._static[pid] for pid in procs if pid in self._static}
+        self._procs = procs
+        self._top = {key: heapq.nlargest(self.precomputed_top, rows, key=lambda r, k=key: r[k])
+                     for key in self.SORT_KEYS}
+        self._rows = rows
+        self.sampled_at = time.time()
+    
+    def top(self, limit, sort_key='memory_percent'):
+        """Return the limit processes with the largest sort_key"""
+        if limit <= self.precomputed_top:
+            return self._top[sort_key][:limit]
+        return heapq.nlargest(limit, self._rows, key=lambda r: r[sort_key])
+
 
 class RemoteCommandServer:
-    def __init__(self, host='127.0.0.1', port=9999, auth_token: str | None = None):
+    # Default connection limits: OS threads are expensive, event-loop connections are not
+    DEFAULT_MAX_CONNECTIONS = {'threaded': 256, 'async': 16384}
+    ADMISSION_POLICIES = ('queue', 'reject', 'shed')
+    # Seconds a successful response may be reused; commands not listed are never cached
+    DEFAULT_CACHE_TTLS = {'netinfo': 2.0, 'diskspace': 2.0, 'findfile': 5.0}
+    # Rate-limit tokens a request costs; commands not listed cost 1
+    DEFAULT_COMMAND_COSTS = {'findfile': 20, 'du': 50, 'ping': 10, 'listdir': 5, 'processlist': 5,
+                             'netinfo': 2, 'diskspace': 2, 'refresh': 10}
+    # Seconds a command may run before it is stopped; commands not listed are cheap
+    DEFAULT_COMMAND_TIMEOUTS = {'findfile': 60.0, 'listdir': 60.0, 'du': 300.0, 'ping': 120.0, 'batch': 300.0}
+    # listdir sort keys and the entry field each one orders by
+    LIST_SORT_KEYS = {'name': 'name', 'size': 'size', 'mtime': 'modified'}
+    LIST_FIELDS = ('name', 'size', 'modified', 'is_dir')
+    # Shapes of tabular results: a list of dicts, or pack_columns() output
+    RESULT_FORMATS = ('rows', 'columns')
+    
+    BUSY_RESPONSE = {'status': 'error', 'error': 'Server busy, try again later', 'code': 'busy'}
+    
+    def __init__(self, host='127.0.0.1', port=9999, auth_token: str | None = None,
+                 mode: str = 'threaded', executor_workers: int | None = None,
+                 max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+                 batch_workers: int = 8, max_batch_size: int = 64,
+                 reuse_port: bool = False, worker_index: int | None = None, shared_clients=None,
+                 max_connections: int | None = None, admission_policy: str = 'queue',
+                 queue_size: int = 64, backlog: int = 128,
+                 cache_ttls: dict | None = None, cache_size: int = 1024,
+                 command_timeouts: dict | None = None,
+                 hostname_ttl: float | None = None, process_sample_interval: float = 2.0,
+                 max_find_results: int = 10000, index_roots: list | None = None,
+                 index_dir: str | None = None, index_rescan_interval: float = 3600.0,
+                 walk_workers: int = 16, walk_max_entries: int | None = 1000000,
+                 max_list_results: int = 10000, list_snapshot_entries: int = 2000000, du_cache_size: int = 1000000, du_cache_max_age: float = 300.0,
+                 max_ping_hosts: int = 1024, ping_concurrency: int = 256,
+                 lane_queue_size: int = 256, rate_limit: float | None = None,
+                 rate_burst: float | None = None, command_costs: dict | None = None,
+                 compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD, legacy_token_auth: bool = True,
+                 idle_timeout: float = 600.0, keepalive_idle: int = 60, keepalive_interval: int = 10,
+                 keepalive_count: int = 6):
         self.host = host
         self.port = port
         self.server_socket = None
         self.running = False
-        self.clients = []
+        # Connected clients (ClientConnection) keyed by socket (threaded) or stream writer (async)
+        self.clients = {}
+        # Multi-process mode: per-worker connection counts in shared memory, indexed by worker
+        self.reuse_port = reuse_port
+        self.worker_index = worker_index
+        self.shared_clients = shared_clients
         self.auth_token = auth_token or os.environ.get('RCE_TOKEN')
+        # Whether a token inside a request still authorizes it on connections without a handshake
+        self.legacy_token_auth = legacy_token_auth
+        self.auth_stats = {'succeeded': 0, 'failed': 0}
+        
+        # Connections with nothing in flight that send nothing for idle_timeout
+        # seconds are closed by the reaper; 0 keeps them forever. TCP keepalive
+        # (0 idle seconds to leave it off) catches peers that vanished without
+        # closing, which an idle timeout alone would only notice much later.
+        self.idle_timeout = idle_timeout
+        self.keepalive = (keepalive_idle, keepalive_interval, keepalive_count)
+        self.reaped_connections = 0
+        self.mode = mode
+        self.executor_workers = executor_workers
+        self.lane_queue_size = lane_queue_size
+        self.max_frame_size = max_frame_size
+        # Frames smaller than this are never compressed, even once a client negotiates it
+        self.compress_threshold = compress_threshold
+        self.slow_lane = None
+        self.fast_completed = 0
+        # Incremented from every connection thread in threaded mode
+        self._fast_lock = threading.Lock()
+        self._loop = None
+        self._async_server = None
+        self._async_stopped = None
+        self.max_batch_size = max_batch_size
+        
+        # Admission control: at most max_connections are served at once; what happens
+        # to the next one depends on the policy (wait in a bounded queue, get a "busy"
+        # error, or displace the longest-idle connection)
+        if admission_policy not in self.ADMISSION_POLICIES:
+            raise ValueError(f"Unknown admission policy: {admission_policy}")
+        self.max_connections = max_connections or self.DEFAULT_MAX_CONNECTIONS[mode]
+        self.admission_policy = admission_policy
+        self.queue_size = queue_size
+        self.backlog = backlog
+        self.connection_pool = None
+        self._admitted = 0
+        self._admission_lock = threading.Lock()
+        self._connection_slots = None
+        self.admission_stats = {'accepted': 0, 'queued': 0, 'rejected': 0, 'shed': 0}
+        
+        # Short-lived cache so bursts of identical expensive requests share one computation
+        self.cache = ResultCache({**self.DEFAULT_CACHE_TTLS, **(cache_ttls or {})}, cache_size)
+        
+        # Default run time limits; a request may ask for less with a 'deadline' field
+        self.command_timeouts = {**self.DEFAULT_COMMAND_TIMEOUTS, **(command_timeouts or {})}
+        self.cancel_stats = {'cancelled': 0, 'timeout': 0}
+        
+        # Optional token-bucket limits per client IP and per auth token
+        self.command_costs = {**self.DEFAULT_COMMAND_COSTS, **(command_costs or {})}
+        self.rate_limiter = RateLimiter(rate_limit, rate_burst) if rate_limit else None
+        
+        # Static host facts are computed once at startup and served as ready-made
+        # responses; hostname/fqdn may optionally expire and refresh in the background
+        self.hostname_ttl = hostname_ttl
+        self._sysinfo_response = None
+        self._hostname_response = None
+        self._hostname_expires = None
+        self._hostname_refreshing = False
+        self._host_facts_lock = threading.Lock()
+        
+        # processlist is answered from a periodically refreshed table; 0 disables sampling
+        self.process_sample_interval = process_sample_interval
+        self.process_sampler = None
+        self.max_find_results = max_find_results
+        self.max_list_results = max_list_results
+        # Sort keys of listings still being paged through; 0 rescans the directory for every page
+        self.list_snapshots = ListingSnapshots(list_snapshot_entries) if list_snapshot_entries else None
+        self.max_ping_hosts = max_ping_hosts
+        self.ping_concurrency = ping_concurrency
+        
+        # Optional filename index consulted by findfile before walking the tree
+        self.index_roots = index_roots or []
+        self.index_dir = index_dir
+        self.index_rescan_interval = index_rescan_interval
+        self.file_index = None
+        
+        # Directory reads of recursive walks run ahead on this pool; each walk
+        # keeps at most walk_workers reads outstanding and examines at most
+        # walk_max_entries entries per request (None for no limit)
+        self.walk_workers = walk_workers
+        self.walk_max_entries = walk_max_entries or None
+        self.walk_executor = ThreadPoolExecutor(max_workers=walk_workers, thread_name_prefix='rce-walk')
+        self.disk_usage = DiskUsageCache(self.walk_executor, max_outstanding=walk_workers, max_entries=du_cache_size,
+                                         max_age=du_cache_max_age)
+        # Dedicated pool so concurrent batch entries never wait behind the batch request itself
+        self.batch_executor = ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix='rce-batch')
         
         # Define the allowed commands and their handlers
         self.commands = {
             'sysinfo': self.get_system_info,
             'listdir': self.list_directory,
             'diskspace': self.get_disk_space,
+            'du': self.get_directory_usage,
             'processlist': self.get_process_list,
             'meminfo': self.get_memory_info,
             'netinfo': self.get_network_info,
@@ -33,32 +686,71 @@ class RemoteCommandServer:
             'hostname': self.get_hostname,
             'echo': self.echo_message,
             'ping': self.ping_host,
-            'findfile': self.find_file
+            'findfile': self.find_file,
+            'batch': self.run_batch,
+            'stats': self.get_server_stats,
+            'refresh': self.refresh_host_facts
         }
         
+        # Fast lane: commands cheap enough to run directly on the connection's
+        # thread or the event loop, so health checks never queue behind heavy
+        # work. Everything else may block (filesystem walks, DNS, subprocesses)
+        # and runs on the bounded slow lane.
+        self.inline_commands = {'echo', 'uptime', 'meminfo', 'stats', 'sysinfo', 'hostname'}
+        if self.process_sample_interval:
+            # Answered from the sampler's precomputed table
+            self.inline_commands.add('processlist')
+        
     def start(self):
         """Start the server and listen for connections"""
+        # Resolve host facts (including a possibly slow reverse-DNS lookup) before serving
+        self.refresh_host_facts({})
+        if self.process_sample_interval:
+            self.process_sampler = ProcessSampler(self.process_sample_interval)
+            self.process_sampler.start()
+        if self.index_roots:
+            # Under --workers only worker 0 builds and watches; the others load what it saves
+            follower = self.worker_index is not None and self.worker_index != 0
+            self.file_index = FileIndex(self.index_roots, self.index_dir, self.index_rescan_interval,
+                                        follower=follower)
+            self.file_index.start()
+        
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            # Let several worker processes bind the same port; the kernel balances accepts
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         
         try:
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket.listen(self.backlog)
             self.running = True
             self._setup_logging()
             logging.info(json.dumps({
                 'event': 'server_started',
                 'host': self.host,
                 'port': self.port,
-                'system': platform.system(),
-                'version': platform.version(),
+                'system': self._sysinfo_response['result']['system'],
+                'version': self._sysinfo_response['result']['version'],
                 'cwd': os.getcwd(),
                 'commands': list(self.commands.keys()),
-                'auth_enabled': bool(self.auth_token)
+                'auth_enabled': bool(self.auth_token),
+                'mode': self.mode,
+                'worker': self.worker_index,
+                'max_connections': self.max_connections,
+                'admission_policy': self.admission_policy
             }))
             
+            # Bounded pool shared by every request of a slow command
+            self.slow_lane = Lane('slow', self.executor_workers, self.lane_queue_size)
+            
             # Start accepting client connections
-            self.accept_connections()
+            if self.mode == 'async':
+                asyncio.run(self.serve_async())
+            else:
+                if self.idle_timeout:
+                    threading.Thread(target=self._reap_periodically, name='rce-reaper', daemon=True).start()
+                self.accept_connections()
             
         except Exception as e:
             print(f"[-] Error starting server: {e}")
@@ -66,72 +758,720 @@ class RemoteCommandServer:
             
     def accept_connections(self):
         """Accept incoming client connections"""
+        self.connection_pool = ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix='rce-conn')
         while self.running:
             try:
                 client_socket, client_address = self.server_socket.accept()
-                client_handler = threading.Thread(
-                    target=self.handle_client,
-                    args=(client_socket, client_address)
-                )
-                client_handler.daemon = True
-                client_handler.start()
-                self.clients.append((client_socket, client_address, client_handler))
-                logging.info(json.dumps({'event': 'client_connected', 'ip': client_address[0], 'port': client_address[1]}))
+                if self._admit(client_address) == 'rejected':
+                    self._reject(client_socket)
+                    continue
+                self._configure_socket(client_socket)
+                client = ClientConnection(client_address)
+                self.clients[client_socket] = client
+                self._update_client_count()
+                # Queued connections wait here until a pool thread frees up
+                client.handler = self.connection_pool.submit(self.handle_client, client_socket, client_address)
+                logging.info(json.dumps({'event': 'client_connected', 'ip': client_address[0], 'port': client_address[1], 'clients': self.client_count()}))
             except Exception as e:
                 if self.running:
                     logging.error(json.dumps({'event': 'accept_error', 'error': str(e)}))
                 break
     
+    def _admit(self, client_address):
+        """Apply the admission policy to a new connection and record the outcome"""
+        with self._admission_lock:
+            if self._admitted < self.max_connections:
+                outcome = 'accepted'
+            elif self.admission_policy == 'queue' and self._admitted < self.max_connections + self.queue_size:
+                outcome = 'queued'
+            elif self.admission_policy == 'shed' and self._shed_idle_connection():
+                outcome = 'shed'
+            else:
+                outcome = 'rejected'
+            self.admission_stats[outcome] += 1
+            if outcome != 'rejected':
+                self._admitted += 1
+        if outcome != 'accepted':
+            logging.warning(json.dumps({'event': f'connection_{outcome}', 'ip': client_address[0], 'port': client_address[1], 'admitted': self._admitted}))
+        return outcome
+    
+    def _release(self):
+        """Give back the admission slot of a connection that has finished"""
+        with self._admission_lock:
+            self._admitted -= 1
+    
+    def _shed_idle_connection(self):
+        """Close the connection that has been idle the longest to make room; False if none is idle"""
+        idle = [(client.last_active, key, client) for key, client in list(self.clients.items())
+                if client.idle and not client.closing]
+        if not idle:
+            return False
+        _, key, client = min(idle, key=lambda item: item[0])
+        self._close_connection(key, client)
+        return True
+    
+    def _close_connection(self, key, client):
+        """Close a client's connection from outside its handler, which then cleans up as usual"""
+        client.closing = True
+        if self.mode == 'async':
+            key.close()
+        else:
+            # Wakes the handler blocked in recv(), which then frees its pool thread
+            try:
+                key.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def _configure_socket(self, sock):
+        """Turn on TCP keepalive with the configured timing, where the platform allows"""
+        idle, interval, count = self.keepalive
+        if not idle:
+            return
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+            elif hasattr(socket, 'TCP_KEEPALIVE'):
+                # macOS names the idle time TCP_KEEPALIVE
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+            elif hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+                sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+            if hasattr(socket, 'TCP_USER_TIMEOUT'):
+                # Also give up on a peer that stops acknowledging data we are sending
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, (idle + interval * count) * 1000)
+        except OSError as e:
+            logging.warning(json.dumps({'event': 'keepalive_error', 'error': str(e)}))
+    
+    def _reap_idle_connections(self):
+        """Close connections idle for longer than idle_timeout; returns how many"""
+        now = time.monotonic()
+        reaped = 0
+        for key, client in list(self.clients.items()):
+            if client.closing or not client.idle or now - client.last_active < self.idle_timeout:
+                continue
+            self._close_connection(key, client)
+            reaped += 1
+            logging.info(json.dumps({'event': 'connection_reaped', 'ip': client.address[0], 'port': client.address[1],
+                                     'idle_seconds': round(now - client.last_active, 1)}))
+        self.reaped_connections += reaped
+        return reaped
+    
+    def _reap_interval(self):
+        return max(1.0, min(30.0, self.idle_timeout / 4))
+    
+    def _reap_periodically(self):
+        """Reaper thread of threaded mode"""
+        while self.running:
+            time.sleep(self._reap_interval())
+            self._reap_idle_connections()
+    
+    async def _reap_periodically_async(self):
+        """Reaper task of async mode; closing writers has to happen on the event loop"""
+        while self.running:
+            await asyncio.sleep(self._reap_interval())
+            self._reap_idle_connections()
+    
+    def _reject(self, client_socket):
+        """Turn a connection away with a structured busy error"""
+        try:
+            client_socket.sendall(encode_message(self.BUSY_RESPONSE))
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+    
     def handle_client(self, client_socket, client_address):
         """Handle communication with a connected client"""
+        client = self.clients[client_socket]
+        frames = FrameReader(self.max_frame_size)
+        send_lock = threading.Lock()
+        in_flight = set()
+        exited = False
+        
+        def send(message):
+            # Pipelined responses are written from executor threads
+            with send_lock:
+                client_socket.sendall(encode_message(message, client.encoding, client.compression))
+        
         try:
             while self.running:
-                # Receive command from client
-                data = client_socket.recv(4096)
-                if not data:
+                # Receive the next complete request frame from the client
+                body = frames.recv_frame(client_socket)
+                if body is None:
                     break
                 
-                # Parse the received command
-                try:
-                    command_data = json.loads(data.decode('utf-8'))
-                    command = command_data.get('command', '')
-                    args = command_data.get('args', {})
-                    token = command_data.get('token')
-                    
-                    if command == 'exit':
+                command_data, response = self.parse_request(body, client.encoding)
+                if command_data is not None and command_data.get('command') == 'heartbeat':
+                    # Only keeps the connection from being reaped, and only a trusted one; never answered
+                    if self._authorized(client, command_data):
+                        client.touch()
+                    continue
+                client.touch()
+                if command_data is not None:
+                    if command_data.get('command', '') == 'exit':
+                        exited = True
                         break
-                    
-                    # Authentication check if enabled
-                    if self.auth_token is not None:
-                        if token != self.auth_token:
-                            response = {'status': 'error', 'error': 'Unauthorized'}
-                            client_socket.sendall(json.dumps(response).encode('utf-8'))
+                    if command_data.get('command') == 'cancel':
+                        send(self.cancel_request(client, command_data))
+                        continue
+                    if command_data.get('command') == 'hello':
+                        # Answered in the old encoding; everything after it uses the new one
+                        response, session = self.negotiate(client, command_data, in_flight)
+                        send(response)
+                        client.encoding, client.compression = session
+                        frames.compression = client.compression
+                        continue
+                    if command_data.get('command') == 'auth':
+                        send(self.authenticate(client, command_data))
+                        continue
+                    rejected = self._unauthorized(client, command_data) or self._throttle(client, command_data)
+                    if rejected is not None:
+                        send(rejected)
+                        continue
+                    request = self._track_request(client, command_data)
+                    client.begin_request()
+                    if self._is_fast(command_data):
+                        self._count_fast()
+                        self._respond(client, send, command_data, request)
+                        continue
+                    if 'id' in command_data:
+                        # Pipelined request: run concurrently and reply as soon as it completes
+                        future = self.slow_lane.submit(self._respond, client, send, command_data, request)
+                        if future is None:
+                            self._respond_busy(client, send, command_data, request)
                             continue
+                        in_flight.add(future)
+                        future.add_done_callback(in_flight.discard)
+                        continue
+                    # Lockstep request: produced and sent on the slow lane while this thread waits,
+                    # so a streamed response is walked within the lane's bounds too
+                    future = self.slow_lane.submit(self._handle_and_send, send, command_data, request)
+                    if future is None:
+                        self._respond_busy(client, send, command_data, request)
+                        continue
+                    try:
+                        future.result()
+                    finally:
+                        self._untrack_request(client, command_data, request)
+                        client.end_request()
+                    continue
+                
+                # Send response back to client
+                send(response)
                     
-                    # Check if command is in predefined list
-                    if command in self.commands:
-                        handler = self.commands[command]
-                        response = handler(args)
-                    else:
-                        response = {'status': 'error', 'error': f"Unknown command: {command}"}
-                    
-                    # Send response back to client
-                    client_socket.sendall(json.dumps(response).encode('utf-8'))
-                    
-                except json.JSONDecodeError:
-                    response = {'status': 'error', 'error': 'Invalid command format'}
-                    client_socket.sendall(json.dumps(response).encode('utf-8'))
-                    
+        except FrameError as e:
+            # The stream can no longer be resynchronised, so report and drop it
+            logging.error(json.dumps({'event': 'frame_error', 'ip': client_address[0], 'port': client_address[1], 'error': str(e)}))
+            try:
+                # Through send(), as pipelined responses may still be written from executor threads
+                send({'status': 'error', 'error': str(e)})
+            except OSError:
+                pass
         except Exception as e:
             logging.error(json.dumps({'event': 'handle_client_error', 'ip': client_address[0], 'port': client_address[1], 'error': str(e)}))
         finally:
+            if not exited:
+                # Nobody is left to read the answers of requests still running
+                self._cancel_all(client)
+            # Let pipelined requests still in progress deliver their responses
+            wait(list(in_flight))
             client_socket.close()
             logging.info(json.dumps({'event': 'client_disconnected', 'ip': client_address[0], 'port': client_address[1]}))
-            self.clients = [c for c in self.clients if c[0] != client_socket]
+            self.clients.pop(client_socket, None)
+            self._update_client_count()
+            self._release()
+    
+    def _is_fast(self, command_data):
+        return command_data.get('command', '') in self.inline_commands
+    
+    def _busy_response(self, command_data):
+        """Structured busy error for a request refused by a full lane"""
+        response = dict(self.BUSY_RESPONSE)
+        if 'id' in command_data:
+            response['id'] = command_data['id']
+        return response
+    
+    def _respond_busy(self, client, send, command_data, request):
+        try:
+            send(self._busy_response(command_data))
+        finally:
+            self._untrack_request(client, command_data, request)
+            client.end_request()
+    
+    def _count_fast(self):
+        with self._fast_lock:
+            self.fast_completed += 1
+    
+    def _failed_response(self, command_data, error):
+        """Error response for a request whose handling or encoding raised"""
+        logging.error(json.dumps({'event': 'request_error', 'command': command_data.get('command'), 'error': str(error)}))
+        response = {'status': 'error', 'error': str(error)}
+        if 'id' in command_data:
+            response['id'] = command_data['id']
+        return response
+    
+    def _respond(self, client, send, command_data, request):
+        """Execute a request and send its response"""
+        try:
+            self._handle_and_send(send, command_data, request)
+        except OSError:
+            # Client went away before the response was ready
+            pass
+        except Exception as e:
+            # Every request gets an answer, or a client waiting on its id would hang
+            try:
+                send(self._failed_response(command_data, e))
+            except OSError:
+                pass
+        finally:
+            self._untrack_request(client, command_data, request)
+            client.end_request()
+    
+    def _authorized(self, client, command_data):
+        """Whether the connection is authenticated, or the request carries a valid legacy token"""
+        if self.auth_token is None or client.authenticated:
+            return True
+        token = command_data.get('token')
+        return (self.legacy_token_auth and isinstance(token, str)
+                and hmac.compare_digest(token.encode('utf-8'), self.auth_token.encode('utf-8')))
+    
+    def _unauthorized(self, client, command_data):
+        """Error response for a request the connection may not make, or None if it may"""
+        if self._authorized(client, command_data):
+            return None
+        response = {'status': 'error', 'error': 'Unauthorized'}
+        if 'id' in command_data:
+            response['id'] = command_data['id']
+        return response
+    
+    def authenticate(self, client, command_data):
+        """Handle an auth message: check the client's answer to the challenge of its last hello
+        
+        Each challenge allows one attempt. A correct answer marks the
+        connection authenticated; the response carries the server's own
+        proof, so the client can check the server knows the token too.
+        """
+        args = command_data.get('args') or {}
+        challenge, client.challenge = client.challenge, None
+        answer, nonce = args.get('response'), args.get('nonce')
+        if self.auth_token is None:
+            response = {'status': 'success', 'result': {'authenticated': True}}
+        elif challenge is None:
+            response = {'status': 'error', 'error': 'No challenge issued; send hello first'}
+        elif not isinstance(answer, str) or not isinstance(nonce, str) or not nonce:
+            response = {'status': 'error', 'error': 'auth requires response and nonce'}
+        elif hmac.compare_digest(answer.encode('utf-8'), auth_proof(self.auth_token, 'client', challenge, nonce).encode('utf-8')):
+            client.authenticated = True
+            self.auth_stats['succeeded'] += 1
+            response = {'status': 'success', 'result': {
+                'authenticated': True,
+                'proof': auth_proof(self.auth_token, 'server', challenge, nonce)
+            }}
+        else:
+            self.auth_stats['failed'] += 1
+            logging.warning(json.dumps({'event': 'auth_failed', 'ip': client.address[0], 'port': client.address[1]}))
+            response = {'status': 'error', 'error': 'Authentication failed'}
+        if 'id' in command_data:
+            response['id'] = command_data['id']
+        return response
+    
+    def _throttle(self, client, command_data):
+        """Throttle error for a request over its client's rate limit, or None to let it through"""
+        if self.rate_limiter is None:
+            return None
+        # The server has a single token shared by every client, so only the IP tells clients apart
+        keys = [('ip', client.address[0])]
+        retry_after = self.rate_limiter.acquire(keys, self._request_cost(command_data))
+        if not retry_after:
+            return None
+        response = {'status': 'error', 'error': 'Rate limit exceeded', 'code': 'throttled',
+                    'retry_after': round(retry_after, 3)}
+        if 'id' in command_data:
+            response['id'] = command_data['id']
+        return response
+    
+    def _request_cost(self, command_data):
+        """Rate-limit tokens a request costs; a batch costs the sum of its entries"""
+        command = command_data.get('command', '')
+        args = command_data.get('args') or {}
+        if command == 'batch' and isinstance(args.get('commands'), list):
+            return sum(self.command_costs.get(entry.get('command'), 1) if isinstance(entry, dict) else 1
+                       for entry in args['commands'])
+        return self.command_costs.get(command, 1)
+    
+    def negotiate(self, client, command_data, in_flight):
+        """Answer a hello request, returning (response, (encoding, compression) for the rest of the connection)
+        
+        The first of the client's encodings, and of the compressions it
+        offers, that the server supports is chosen; if it offers no usable
+        compression, frames stay uncompressed. The switch only happens while
+        nothing is in flight, so no response can arrive in a form the client
+        does not expect yet. When a token is required, the result also carries
+        a fresh challenge for the client to answer with an auth message.
+        """
+        args = command_data.get('args') or {}
+        offered = args.get('encodings', ['json'])
+        offered_compressions = args.get('compression', [])
+        session = (client.encoding, client.compression)
+        if in_flight:
+            response = {'status': 'error', 'error': 'hello must be sent while no requests are in flight'}
+        elif not isinstance(offered, list) or not isinstance(offered_compressions, list):
+            response = {'status': 'error', 'error': 'encodings and compression must be lists of names'}
+        else:
+            chosen = next((name for name in offered if name in ENCODINGS), None)
+            compression = next((name for name in offered_compressions if name in COMPRESSIONS), None)
+            if chosen is None:
+                response = {'status': 'error', 'error': f"None of the offered encodings is supported; "
+                                                        f"available: {', '.join(ENCODINGS)}"}
+            else:
+                response = {'status': 'success', 'result': {
+                    'encoding': chosen,
+                    'encodings': list(ENCODINGS),
+                    'compression': compression,
+                    'compressions': list(COMPRESSIONS),
+                    'compress_threshold': self.compress_threshold
+                }}
+                if self.auth_token is not None and not client.authenticated:
+                    # Answered by an auth message; a later hello replaces it
+                    client.challenge = secrets.token_hex(16)
+                    response['result']['challenge'] = client.challenge
+                session = (chosen, COMPRESSIONS[compression](self.compress_threshold) if compression else None)
+                logging.info(json.dumps({'event': 'session_negotiated', 'ip': client.address[0], 'port': client.address[1],
+                                         'encoding': chosen, 'compression': compression}))
+        if 'id' in command_data:
+            response['id'] = command_data['id']
+        return response, session
+    
+    def _track_request(self, client, command_data):
+        """Create the context of a new request, registering pipelined ones for cancellation"""
+        request = RequestContext(self.cancel_stats)
+        request_id = command_data.get('id')
+        if isinstance(request_id, (str, int)):
+            client.requests[request_id] = request
+        return request
+    
+    @staticmethod
+    def _untrack_request(client, command_data, request):
+        request_id = command_data.get('id')
+        if isinstance(request_id, (str, int)) and client.requests.get(request_id) is request:
+            del client.requests[request_id]
+    
+    def cancel_request(self, client, command_data):
+        """Handle a cancel message: stop the in-flight request of this connection with the given ID"""
+        if not self._authorized(client, command_data):
+            response = {'status': 'error', 'error': 'Unauthorized'}
+        else:
+            args = command_data.get('args') or {}
+            request = client.requests.get(args.get('id')) if isinstance(args.get('id'), (str, int)) else None
+            if request is not None:
+                request.cancel()
+            response = {'status': 'success', 'result': {'id': args.get('id'), 'cancelled': request is not None}}
+        if 'id' in command_data:
+            response['id'] = command_data['id']
+        return response
+    
+    @staticmethod
+    def _cancel_all(client):
+        for request in list(client.requests.values()):
+            request.cancel()
+    
+    def _update_client_count(self):
+        """Publish this worker's connection count to shared memory"""
+        if self.shared_clients is not None:
+            self.shared_clients[self.worker_index] = len(self.clients)
+    
+    def client_count(self):
+        """Number of connected clients, summed across all workers sharing the port"""
+        if self.shared_clients is None:
+            return len(self.clients)
+        return sum(self.shared_clients)
+    
+    def parse_request(self, body, encoding='json'):
+        """Decode a request frame, returning (command_data, None) or (None, error_response)"""
+        try:
+            command_data = decode_message(body, encoding)
+        except ValueError:
+            return None, {'status': 'error', 'error': 'Invalid command format'}
+        if not isinstance(command_data, dict):
+            return None, {'status': 'error', 'error': 'Invalid command format'}
+        return command_data, None
+    
+    def handle_request(self, command_data, request=None):
+        """Execute a single parsed, already authorized request, returning the response"""
+        command = command_data.get('command', '')
+        args = command_data.get('args', {})
+        request = request or RequestContext(self.cancel_stats)
+        
+        # Check if command is in predefined list
+        if command in self.commands:
+            timeout = self._request_timeout(command, command_data.get('deadline'))
+            if timeout is not None:
+                request.limit(timeout)
+            context_token = _current_request.set(request)
+            try:
+                # Refuse requests whose deadline passed before they started, e.g. while queued
+                request.check()
+                response = self.execute(command, args)
+            except RequestCancelled as e:
+                response = e.response()
+            finally:
+                _current_request.reset(context_token)
+        else:
+            response = {'status': 'error', 'error': f"Unknown command: {command}"}
+        
+        # Echo the request ID so pipelining clients can match out-of-order responses
+        if 'id' in command_data:
+            if isinstance(response, StreamingResponse):
+                response = response.with_id(command_data['id'])
+            else:
+                response = {**response, 'id': command_data['id']}
+        return response
+    
+    def _request_timeout(self, command, deadline):
+        """Seconds a request may run: the command's limit, shortened by the client's deadline"""
+        # A command timeout of 0 means no limit, but a deadline of 0 or less has already passed
+        limits = [self.command_timeouts.get(command) or None]
+        if isinstance(deadline, (int, float)) and not isinstance(deadline, bool):
+            limits.append(max(0.0, float(deadline)))
+        limits = [limit for limit in limits if limit is not None]
+        return min(limits) if limits else None
+    
+    def execute(self, command, args):
+        """Run a known command's handler, serving it from the result cache when possible"""
+        if isinstance(args, dict) and args.get('stream'):
+            return self.commands[command](args)
+        return self.cache.get_or_compute(command, args, self.commands[command])
+    
+    def _send_response(self, send, response):
+        """Send a response, one frame per chunk if it is streamed"""
+        if not isinstance(response, StreamingResponse):
+            send(response)
+            return
+        for chunk in response:
+            send(chunk)
+    
+    def _handle_and_send(self, send, command_data, request):
+        """Execute a request and send its response, streamed chunks included, on the calling thread"""
+        self._send_response(send, self.handle_request(command_data, request))
+    
+    def _handle_into(self, channel, command_data, request):
+        """Execute a request on a lane thread, feeding streamed chunks to channel
+        
+        Returns the response, or None if it was streamed through the channel.
+        """
+        try:
+            response = self.handle_request(command_data, request)
+            if not isinstance(response, StreamingResponse):
+                return response
+            chunks = iter(response)
+            try:
+                for chunk in chunks:
+                    if not channel.put(chunk):
+                        break
+            finally:
+                # Stops the walk behind the stream if the writer went away
+                chunks.close()
+            return None
+        finally:
+            channel.finish()
+    
+    async def serve_async(self):
+        """Serve every client connection from a single asyncio event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._async_stopped = asyncio.Event()
+        self._connection_slots = asyncio.Semaphore(self.max_connections)
+        self._async_server = await asyncio.start_server(self.handle_client_async, sock=self.server_socket)
+        reaper = asyncio.create_task(self._reap_periodically_async()) if self.idle_timeout else None
+        async with self._async_server:
+            await self._async_stopped.wait()
+        if reaper is not None:
+            reaper.cancel()
+    
+    async def handle_client_async(self, reader, writer):
+        """Handle communication with a connected client on the event loop"""
+        client_address = writer.get_extra_info('peername')
+        if self._admit(client_address) == 'rejected':
+            writer.write(encode_message(self.BUSY_RESPONSE))
+            writer.close()
+            return
+        self._configure_socket(writer.get_extra_info('socket'))
+        client = ClientConnection(client_address, asyncio.current_task())
+        self.clients[writer] = client
+        self._update_client_count()
+        logging.info(json.dumps({'event': 'client_connected', 'ip': client_address[0], 'port': client_address[1], 'clients': self.client_count()}))
+        in_flight = set()
+        exited = False
+        has_slot = False
+        try:
+            # Queued connections wait here until a slot frees up
+            await self._connection_slots.acquire()
+            has_slot = True
+            while self.running:
+                body = await read_frame(reader, self.max_frame_size, client.compression)
+                if body is None:
+                    break
+                
+                command_data, response = self.parse_request(body, client.encoding)
+                if command_data is not None and command_data.get('command') == 'heartbeat':
+                    if self._authorized(client, command_data):
+                        client.touch()
+                    continue
+                client.touch()
+                if command_data is not None:
+                    if command_data.get('command', '') == 'exit':
+                        exited = True
+                        break
+                    if command_data.get('command') == 'cancel':
+                        writer.write(encode_message(self.cancel_request(client, command_data), client.encoding, client.compression))
+                        await writer.drain()
+                        continue
+                    if command_data.get('command') == 'hello':
+                        response, session = self.negotiate(client, command_data, in_flight)
+                        writer.write(encode_message(response, client.encoding, client.compression))
+                        await writer.drain()
+                        client.encoding, client.compression = session
+                        continue
+                    if command_data.get('command') == 'auth':
+                        writer.write(encode_message(self.authenticate(client, command_data), client.encoding, client.compression))
+                        await writer.drain()
+                        continue
+                    rejected = self._unauthorized(client, command_data) or self._throttle(client, command_data)
+                    if rejected is not None:
+                        writer.write(encode_message(rejected, client.encoding, client.compression))
+                        await writer.drain()
+                        continue
+                    request = self._track_request(client, command_data)
+                    if 'id' in command_data:
+                        # Pipelined request: complete it concurrently, possibly out of order
+                        client.begin_request()
+                        task = asyncio.create_task(self._respond_async(client, writer, command_data, request))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
+                        continue
+                    client.begin_request()
+                    try:
+                        await self._dispatch_and_write(writer, client, command_data, request)
+                    except ConnectionError:
+                        raise
+                    except Exception as e:
+                        # Same as a pipelined request: answer with an error and keep the connection
+                        await self._write_response(writer, self._failed_response(command_data, e), client)
+                    finally:
+                        client.end_request()
+                    continue
+                
+                writer.write(encode_message(response, client.encoding, client.compression))
+                await writer.drain()
+            
+            if not exited:
+                # Nobody is left to read the answers of requests still running
+                self._cancel_all(client)
+            # Let pipelined requests still in progress deliver their responses
+            if in_flight:
+                await asyncio.wait(in_flight)
+                
+        except asyncio.CancelledError:
+            # Server shutdown; the connection is closed below
+            for task in in_flight:
+                task.cancel()
+        except FrameError as e:
+            logging.error(json.dumps({'event': 'frame_error', 'ip': client_address[0], 'port': client_address[1], 'error': str(e)}))
+            writer.write(encode_message({'status': 'error', 'error': str(e)}, client.encoding, client.compression))
+        except Exception as e:
+            logging.error(json.dumps({'event': 'handle_client_error', 'ip': client_address[0], 'port': client_address[1], 'error': str(e)}))
+        finally:
+            if not exited:
+                self._cancel_all(client)
+            writer.close()
+            logging.info(json.dumps({'event': 'client_disconnected', 'ip': client_address[0], 'port': client_address[1]}))
+            self.clients.pop(writer, None)
+            self._update_client_count()
+            if has_slot:
+                self._connection_slots.release()
+            self._release()
+    
+    async def _respond_async(self, client, writer, command_data, request):
+        """Execute a pipelined request and write its response"""
+        try:
+            await self._dispatch_and_write(writer, client, command_data, request)
+        except ConnectionError:
+            # Client went away before the response was ready
+            pass
+        except Exception as e:
+            # Every request gets an answer, or a client waiting on its id would hang
+            try:
+                await self._write_response(writer, self._failed_response(command_data, e), client)
+            except ConnectionError:
+                pass
+        finally:
+            self._untrack_request(client, command_data, request)
+            client.end_request()
+    
+    async def _write_response(self, writer, response, client):
+        """Write one response frame
+        
+        Frames are encoded here on the event loop, in the order they are
+        written, as the connection's compression stream requires.
+        """
+        if not writer.is_closing():
+            writer.write(encode_message(response, client.encoding, client.compression))
+            await writer.drain()
+    
+    async def _dispatch_and_write(self, writer, client, command_data, request=None):
+        """Run fast-lane commands inline and the rest on the slow lane, writing the response
+        
+        A slow command's stream is produced entirely by its lane task, so the
+        walk behind it counts against the lane's bounds and statistics.
+        """
+        if self._is_fast(command_data):
+            self._count_fast()
+            response = self.handle_request(command_data, request)
+            if isinstance(response, StreamingResponse):
+                for chunk in response:
+                    await self._write_response(writer, chunk, client)
+                return
+            await self._write_response(writer, response, client)
+            return
+        channel = StreamChannel(self._loop)
+        future = self.slow_lane.submit(self._handle_into, channel, command_data, request)
+        if future is None:
+            await self._write_response(writer, self._busy_response(command_data), client)
+            return
+        try:
+            while True:
+                chunk = await channel.get()
+                if chunk is None or writer.is_closing():
+                    break
+                await self._write_response(writer, chunk, client)
+        finally:
+            channel.close()
+        response = await asyncio.wrap_future(future)
+        if response is not None:
+            await self._write_response(writer, response, client)
     
     # Predefined command handlers
     def get_system_info(self, args):
-        """Get system information"""
+        """Get system information (memoized; see refresh_host_facts)"""
+        if self._sysinfo_response is None:
+            self._refresh_system_info()
+        return self._sysinfo_response
+    
+    def refresh_host_facts(self, args):
+        """Recompute the memoized sysinfo and hostname responses"""
+        try:
+            self._refresh_system_info()
+            self._refresh_hostname()
+            result = {
+                'sysinfo': self._sysinfo_response['result'],
+                'hostname': self._hostname_response['result']
+            }
+            return {'status': 'success', 'result': result}
+        except Exception as e:
+            return {'status': 'error', 'error': str(e)}
+    
+    def _refresh_system_info(self):
         result = {
             'system': platform.system(),
             'node': platform.node(),
@@ -142,33 +1482,200 @@ class RemoteCommandServer:
             'cpu_count': os.cpu_count(),
             'cwd': os.getcwd()
         }
-        return {'status': 'success', 'result': result}
+        self._sysinfo_response = {'status': 'success', 'result': result}
+    
+    def _refresh_hostname(self):
+        result = {
+            'hostname': socket.gethostname(),
+            'fqdn': socket.getfqdn()
+        }
+        self._hostname_response = {'status': 'success', 'result': result}
+        if self.hostname_ttl:
+            self._hostname_expires = time.monotonic() + self.hostname_ttl
+    
+    def _refresh_hostname_background(self):
+        try:
+            self._refresh_hostname()
+        except Exception as e:
+            logging.error(json.dumps({'event': 'hostname_refresh_error', 'error': str(e)}))
+        finally:
+            self._hostname_refreshing = False
     
     def list_directory(self, args):
-        """List contents of a directory"""
+        """List a directory a page at a time, optionally filtered, sorted and trimmed to some fields"""
         try:
-            path = args.get('path', '.')
-            files = os.listdir(path)
-            
-            file_info = []
-            for file in files:
-                full_path = os.path.join(path, file)
-                stats = os.stat(full_path)
-                info = {
-                    'name': file,
-                    'size': stats.st_size,
-                    'modified': stats.st_mtime,
-                    'is_dir': os.path.isdir(full_path)
+            cursor = args.get('cursor')
+            if cursor:
+                try:
+                    state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+                    after = state.pop('after')
+                    token, offset = state.pop('snapshot', None), int(state.pop('offset', 0))
+                    options = state
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    return {'status': 'error', 'error': 'Invalid cursor'}
+            else:
+                options = {
+                    'path': args.get('path', '.'),
+                    'sort': args.get('sort', 'name'),
+                    'reverse': bool(args.get('reverse', False)),
+                    'pattern': args.get('pattern'),
+                    'min_size': args.get('min_size'),
+                    'max_size': args.get('max_size'),
+                    'modified_after': args.get('modified_after'),
+                    'modified_before': args.get('modified_before'),
+                    'fields': list(args.get('fields') or self.LIST_FIELDS),
+                    'limit': int(args.get('limit', 1000))
                 }
-                file_info.append(info)
-                
-            return {'status': 'success', 'result': file_info}
+                after = token = None
+                offset = 0
+            
+            result_format = args.get('format', 'rows')
+            if options['sort'] not in self.LIST_SORT_KEYS:
+                return {'status': 'error', 'error': f"Invalid sort key: {options['sort']}"}
+            if result_format not in self.RESULT_FORMATS:
+                return {'status': 'error', 'error': f"Invalid format: {result_format}"}
+            unknown = [field for field in options['fields'] if field not in self.LIST_FIELDS]
+            if unknown:
+                return {'status': 'error', 'error': f"Invalid fields: {', '.join(unknown)}"}
+            
+            limit = min(int(options.get('limit', 1000)), self.max_list_results)
+            if limit < 1:
+                return {'status': 'error', 'error': 'limit must be at least 1'}
+            
+            remaining = self.list_snapshots.get(token) if token and self.list_snapshots is not None else None
+            if remaining is not None and offset <= len(remaining) and (offset == 0 or list(remaining[offset - 1]) == after):
+                # Later page of a remembered listing: only this page's entries are looked at again
+                page = self._snapshot_page(options, remaining[offset:offset + limit])
+                more = offset + limit < len(remaining)
+                last_key = remaining[min(offset + limit, len(remaining)) - 1] if more else None
+                offset += limit
+            else:
+                page, more, token = self._scan_page(options, after, limit)
+                last_key = page[-1][0] if more else None
+                offset = 0
+            
+            cursor = None
+            if more:
+                state = {**options, 'after': list(last_key)}
+                if token is not None:
+                    state.update(snapshot=token, offset=offset)
+                cursor = base64.urlsafe_b64encode(json.dumps(state).encode('utf-8')).decode('ascii')
+            result = [info for _, info in page]
+            count = len(result)
+            if result_format == 'columns':
+                result = pack_columns(result, ('modified',))
+            return {'status': 'success', 'result': result, 'count': count, 'cursor': cursor}
         except Exception as e:
             return {'status': 'error', 'error': str(e)}
     
+    def _scan_page(self, options, after, limit):
+        """(page, more, snapshot token) from one pass over the directory
+        
+        Only limit entries are kept as full rows. When the directory has more,
+        the sort keys of the rest are remembered (if they fit in the snapshot
+        store) so that the following pages are slices instead of rescans.
+        """
+        entries = self._iter_listing(options, after, current_request())
+        keys = None
+        if self.list_snapshots is not None:
+            keys = []
+            entries = self._collect_keys(entries, keys, self.list_snapshots.max_entries + limit)
+        # Only the page being returned is kept as rows, however large the directory
+        if options['reverse']:
+            page = heapq.nlargest(limit + 1, entries, key=lambda item: item[0])
+        else:
+            page = heapq.nsmallest(limit + 1, entries, key=lambda item: item[0])
+        if len(page) <= limit:
+            return page, False, None
+        token = None
+        if keys is not None and len(keys) <= self.list_snapshots.max_entries + limit:
+            keys.sort(reverse=options['reverse'])
+            token = self.list_snapshots.store(keys[limit:])
+        return page[:limit], True, token
+    
+    @staticmethod
+    def _collect_keys(entries, keys, max_keys):
+        """Pass entries through, recording their sort keys until there are more than max_keys"""
+        for key, info in entries:
+            if len(keys) <= max_keys:
+                keys.append(key)
+            yield key, info
+    
+    def _snapshot_page(self, options, keys):
+        """Rows for remembered sort keys, with size and times read again; vanished entries are skipped"""
+        fields = options['fields']
+        needs_stat = self._listing_needs_stat(options)
+        page = []
+        for key in keys:
+            name = key[-1]
+            info = {'name': name}
+            path = os.path.join(options['path'], name)
+            try:
+                if needs_stat or 'is_dir' in fields:
+                    stats = os.stat(path)
+                    info['size'] = stats.st_size
+                    info['modified'] = stats.st_mtime
+                    info['is_dir'] = stat.S_ISDIR(stats.st_mode)
+            except OSError:
+                continue
+            page.append((key, {field: info[field] for field in fields}))
+        return page
+    
+    @staticmethod
+    def _listing_needs_stat(options):
+        # stat() is the expensive part; skip it when nothing needs size or mtime
+        return (options['sort'] != 'name' or 'size' in options['fields'] or 'modified' in options['fields']
+                or any(options.get(bound) is not None
+                       for bound in ('min_size', 'max_size', 'modified_after', 'modified_before')))
+    
+    def _iter_listing(self, options, after=None, request=None):
+        """Yield (sort key, info) for directory entries passing the filters and beyond after"""
+        sort, fields = options['sort'], options['fields']
+        pattern = options.get('pattern')
+        size_bounds = (options.get('min_size'), options.get('max_size'))
+        mtime_bounds = (options.get('modified_after'), options.get('modified_before'))
+        needs_stat = self._listing_needs_stat(options)
+        after = tuple(after) if after is not None else None
+        
+        with os.scandir(options['path']) as it:
+            for count, entry in enumerate(it):
+                if request is not None and count % 1024 == 0:
+                    request.check()
+                name = entry.name
+                if pattern and not fnmatch.fnmatch(name, pattern):
+                    continue
+                if sort == 'name' and after is not None and ((name,) >= after if options['reverse'] else (name,) <= after):
+                    # Already listed; the name alone says so, without a stat
+                    continue
+                info = {'name': name}
+                if needs_stat:
+                    try:
+                        # DirEntry caches this; symlinks are reported as their target like os.stat did
+                        stats = entry.stat()
+                    except OSError:
+                        continue
+                    if not self._within(stats.st_size, size_bounds) or not self._within(stats.st_mtime, mtime_bounds):
+                        continue
+                    info['size'] = stats.st_size
+                    info['modified'] = stats.st_mtime
+                
+                key = (name,) if sort == 'name' else (info[self.LIST_SORT_KEYS[sort]], name)
+                if after is not None and (key >= after if options['reverse'] else key <= after):
+                    continue
+                if 'is_dir' in fields:
+                    info['is_dir'] = entry.is_dir()
+                yield key, {field: info[field] for field in fields}
+    
+    @staticmethod
+    def _within(value, bounds):
+        low, high = bounds
+        return (low is None or value >= low) and (high is None or value <= high)
+    
     def get_disk_space(self, args):
-        """Get disk space information"""
+        """Get disk space information for a path, or for every mounted filesystem"""
         try:
+            if args.get('all'):
+                return {'status': 'success', 'result': self._get_all_disk_space()}
             path = args.get('path', '.')
             usage = shutil.disk_usage(path)
             result = {
@@ -181,23 +1688,83 @@ class RemoteCommandServer:
         except Exception as e:
             return {'status': 'error', 'error': str(e)}
     
+    def _get_all_disk_space(self):
+        """Block and inode usage of every real mount, one statvfs call each"""
+        mounts = []
+        seen = set()
+        for partition in psutil.disk_partitions(all=False):
+            if partition.mountpoint in seen:
+                continue
+            seen.add(partition.mountpoint)
+            try:
+                if hasattr(os, 'statvfs'):
+                    st = os.statvfs(partition.mountpoint)
+                    total = st.f_blocks * st.f_frsize
+                    free = st.f_bavail * st.f_frsize
+                    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+                    inodes = {
+                        'inodes_total': st.f_files,
+                        'inodes_used': st.f_files - st.f_ffree,
+                        'inodes_free': st.f_favail,
+                        'inodes_percent_used': ((st.f_files - st.f_ffree) / st.f_files) * 100 if st.f_files else None
+                    }
+                else:
+                    total, used, free = shutil.disk_usage(partition.mountpoint)
+                    inodes = {}
+            except OSError:
+                # Unreadable or disconnected mounts (e.g. a stale network share) are left out
+                continue
+            if not total:
+                continue
+            mounts.append({
+                'device': partition.device,
+                'mountpoint': partition.mountpoint,
+                'fstype': partition.fstype,
+                'total': total,
+                'used': used,
+                'free': free,
+                'percent_used': (used / total) * 100,
+                **inodes
+            })
+        return mounts
+    
+    def get_directory_usage(self, args):
+        """Get the recursive size of a directory tree and its largest directories"""
+        try:
+            path = args.get('path', '.')
+            if not os.path.isdir(path):
+                return {'status': 'error', 'error': f"Not a directory: {path}"}
+            top = max(0, min(int(args.get('top', 10)), 1000))
+            # fresh rescans every directory; max_age reuses only directories measured that recently
+            max_age = 0 if args.get('fresh') else args.get('max_age')
+            result = self.disk_usage.measure(path, top, bool(args.get('one_filesystem', True)),
+                                             check=current_request().check,
+                                             max_age=float(max_age) if max_age is not None else None)
+            return {'status': 'success', 'result': result}
+        except Exception as e:
+            return {'status': 'error', 'error': str(e)}
+    
     def get_process_list(self, args):
-        """Get list of running processes"""
+        """Get the top running processes by memory, CPU, RSS or thread count"""
         try:
             limit = args.get('limit', 10)
-            processes = []
+            sort_key = args.get('sort', 'memory_percent')
+            result_format = args.get('format', 'rows')
+            if sort_key not in ProcessSampler.SORT_KEYS:
+                return {'status': 'error', 'error': f"Invalid sort key: {sort_key}"}
+            if result_format not in self.RESULT_FORMATS:
+                return {'status': 'error', 'error': f"Invalid format: {result_format}"}
             
-            for proc in psutil.process_iter(['pid', 'name', 'username', 'memory_percent', 'cpu_percent', 'create_time']):
-                try:
-                    pinfo = proc.info
-                    processes.append(pinfo)
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    pass
+            sampler = self.process_sampler
+            if sampler is None or not sampler.running:
+                # No background sampler: scan on demand (CPU usage reads as 0.0)
+                sampler = ProcessSampler()
+                sampler.sample()
             
-            # Sort by memory usage and limit results
-            processes = sorted(processes, key=lambda p: p.get('memory_percent', 0), reverse=True)[:limit]
-            
-            return {'status': 'success', 'result': processes}
+            processes = sampler.top(limit, sort_key)
+            if result_format == 'columns':
+                processes = pack_columns(processes, ('create_time',))
+            return {'status': 'success', 'result': processes, 'sampled_at': sampler.sampled_at}
         except Exception as e:
             return {'status': 'error', 'error': str(e)}
     
@@ -296,13 +1863,18 @@ class RemoteCommandServer:
             return {'status': 'error', 'error': str(e)}
     
     def get_hostname(self, args):
-        """Get the system hostname"""
+        """Get the system hostname (memoized; a stale entry is served while it refreshes)"""
         try:
-            result = {
-                'hostname': socket.gethostname(),
-                'fqdn': socket.getfqdn()
-            }
-            return {'status': 'success', 'result': result}
+            if self._hostname_response is None:
+                self._refresh_hostname()
+            elif self._hostname_expires is not None and time.monotonic() >= self._hostname_expires:
+                # Never make a request wait on reverse DNS once a value is known
+                with self._host_facts_lock:
+                    start_refresh = not self._hostname_refreshing
+                    self._hostname_refreshing = True
+                if start_refresh:
+                    threading.Thread(target=self._refresh_hostname_background, daemon=True).start()
+            return self._hostname_response
         except Exception as e:
             return {'status': 'error', 'error': str(e)}
     
@@ -312,87 +1884,453 @@ class RemoteCommandServer:
         return {'status': 'success', 'result': message}
     
     def ping_host(self, args):
-        """Ping a remote host"""
+        """Ping a remote host, or several hosts concurrently, over ICMP or TCP connect"""
         try:
-            host = args.get('host')
-            if not host:
+            multiple = 'hosts' in args
+            hosts = args.get('hosts') if multiple else [args.get('host')]
+            if not isinstance(hosts, list) or not hosts or hosts == [None]:
                 return {'status': 'error', 'error': 'No host specified'}
-                
-            count = args.get('count', 4)
-            # Build argument list and use shell=False
-            if platform.system().lower() == 'windows':
-                cmd = ['ping', '-n', str(count), host]
-            else:
-                cmd = ['ping', '-c', str(count), host]
-            result = subprocess.run(cmd, capture_output=True, text=True, shell=False)
-            stdout, stderr = result.stdout, result.stderr
+            if len(hosts) > self.max_ping_hosts:
+                return {'status': 'error', 'error': f"At most {self.max_ping_hosts} hosts per request"}
+            invalid = [host for host in hosts if not self._valid_ping_target(host)]
+            if invalid:
+                return {'status': 'error', 'error': f"Invalid host: {', '.join(map(str, invalid))}"}
+            method = args.get('method', 'icmp')
+            if method not in pinger.METHODS:
+                return {'status': 'error', 'error': f"Invalid method: {method}"}
             
-            return {
-                'status': 'success' if result.returncode == 0 else 'error',
-                'result': stdout,
-                'error': stderr
-            }
+            count = int(args.get('count', 4))
+            timeout = args.get('timeout')
+            timeout = float(timeout) if timeout is not None else None
+            options = {'count': count, 'timeout': timeout, 'method': method,
+                       'port': int(args.get('port', 80)), 'interval': float(args.get('interval', 1.0))}
+            # Handlers run on worker threads, so each request drives its own short-lived event loop
+            request = current_request()
+            if multiple:
+                probe = pinger.ping_many(hosts, concurrency=self.ping_concurrency, **options)
+                return {'status': 'success', 'result': asyncio.run(run_cancellable(probe, request))}
+            result = asyncio.run(run_cancellable(pinger.ping(hosts[0], **options), request))
+            response = {'status': result.pop('status'), 'result': result}
+            if 'error' in result:
+                response['error'] = result.pop('error')
+            return response
         except Exception as e:
             return {'status': 'error', 'error': str(e)}
     
+    @staticmethod
+    def _valid_ping_target(host):
+        # A leading dash would be read by ping as an option
+        return isinstance(host, str) and bool(host) and not host.startswith('-')
+    
     def find_file(self, args):
-        """Find files matching a pattern"""
+        """Find files matching a pattern, a page at a time or streamed in chunks"""
         try:
-            pattern = args.get('pattern')
-            path = args.get('path', '.')
+            cursor = args.get('cursor')
+            if cursor:
+                try:
+                    state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+                    pattern, path, after = state['pattern'], state['path'], state['after']
+                    kind = state.get('match', 'substring')
+                    args = {**args, 'max_depth': state.get('max_depth')}
+                except (ValueError, KeyError, TypeError):
+                    return {'status': 'error', 'error': 'Invalid cursor'}
+            else:
+                pattern = args.get('pattern')
+                path = args.get('path', '.')
+                kind = args.get('match', 'substring')
+                after = None
             
             if not pattern:
                 return {'status': 'error', 'error': 'No pattern specified'}
-                
-            matches = []
-            for root, dirs, files in os.walk(path):
-                for name in files + dirs:
-                    if pattern.lower() in name.lower():
-                        full_path = os.path.join(root, name)
-                        matches.append({
-                            'path': full_path,
-                            'is_dir': os.path.isdir(full_path)
-                        })
-                        
-                        # Limit results to avoid overwhelming response
-                        if len(matches) >= 100:
-                            break
-                
-                if len(matches) >= 100:
+            if kind not in QUERY_KINDS:
+                return {'status': 'error', 'error': f"Invalid match type: {kind}"}
+            result_format = args.get('format', 'rows')
+            if result_format not in self.RESULT_FORMATS:
+                return {'status': 'error', 'error': f"Invalid format: {result_format}"}
+            columns = result_format == 'columns'
+            try:
+                query = compile_query(pattern, kind)
+            except re.error as e:
+                return {'status': 'error', 'error': f"Invalid pattern: {e}"}
+            
+            max_depth = args.get('max_depth')
+            max_depth = int(max_depth) if max_depth is not None else None
+            
+            # Clients choose a page size; the server caps it
+            limit = min(int(args.get('limit', 100)), self.max_find_results)
+            if limit < 1:
+                return {'status': 'error', 'error': 'limit must be at least 1'}
+            walker = self._make_walker(max_depth, current_request().check)
+            matches = self._iter_matches(path, query, kind, walker, after)
+            search = {'path': path, 'pattern': pattern, 'match': kind}
+            if max_depth is not None:
+                search['max_depth'] = max_depth
+            
+            if args.get('stream'):
+                chunk_size = max(1, int(args.get('chunk_size', 100)))
+                return StreamingResponse(self._stream_matches(matches, walker, search, limit, chunk_size, columns))
+            
+            results = []
+            position = None
+            for match, position in matches:
+                results.append(match)
+                if len(results) >= limit:
                     break
+            matches.close()
             
-            return {'status': 'success', 'result': matches, 'count': len(matches)}
+            response = {'status': 'success', 'result': pack_columns(results) if columns else results, 'count': len(results)}
+            response.update(self._find_continuation(walker, search, position, len(results) >= limit))
+            return response
+        except Exception as e:
+            return {'status': 'error', 'error': str(e)}
+    
+    def _stream_matches(self, matches, walker, search, limit, chunk_size, columns=False):
+        """Yield find_file matches in chunks as the walk discovers them, each chunk columnar if columns"""
+        chunk = []
+        count = 0
+        position = None
+        for match, position in matches:
+            chunk.append(match)
+            count += 1
+            if count >= limit:
+                break
+            if len(chunk) >= chunk_size:
+                yield {'status': 'success', 'result': pack_columns(chunk) if columns else chunk, 'more': True}
+                chunk = []
+        matches.close()
+        
+        final = {'status': 'success', 'result': pack_columns(chunk) if columns else chunk, 'more': False, 'count': count}
+        final.update(self._find_continuation(walker, search, position, count >= limit))
+        yield final
+    
+    def _find_continuation(self, walker, search, position, limit_reached):
+        """Cursor (and truncation flag) to put in the last find_file response"""
+        if limit_reached:
+            return {'cursor': self._find_cursor(search, position)}
+        if walker.truncated:
+            # Entry budget ran out before the limit; resume from the last entry examined
+            return {'cursor': self._find_cursor(search, walker.last_position), 'truncated': True}
+        return {'cursor': None}
+    
+    @staticmethod
+    def _find_cursor(search, position):
+        """Continuation token resuming a find right after the given walk position"""
+        state = {**search, 'after': list(position)}
+        return base64.urlsafe_b64encode(json.dumps(state).encode('utf-8')).decode('ascii')
+    
+    def _iter_matches(self, path, query, kind, walker, after=None):
+        """Yield ({path, is_dir}, position) for every entry under path whose name matches query"""
+        if self.file_index is not None and self.file_index.covers(path):
+            for count, (match, position) in enumerate(self.file_index.search(path, query, verify=(kind == 'regex'), after=after or ())):
+                if count % 1024 == 0 and walker.check is not None:
+                    walker.check()
+                if walker.max_depth is None or len(position) <= walker.max_depth:
+                    yield match, position
+            return
+        for entry, position in walker.walk(path, after or ()):
+            if query.search(entry.name.lower()):
+                yield {'path': entry.path, 'is_dir': entry.is_dir()}, position
+    
+    def _make_walker(self, max_depth=None, check=None):
+        """A parallel walker bounded by this server's walk settings"""
+        return ParallelWalker(self.walk_executor, max_outstanding=self.walk_workers,
+                              max_depth=max_depth, max_entries=self.walk_max_entries, check=check)
+    
+    def get_server_stats(self, args):
+        """Get connection and admission counters for this server process"""
+        result = {
+            'mode': self.mode,
+            'worker': self.worker_index,
+            'clients': len(self.clients),
+            'clients_total': self.client_count(),
+            'admitted': self._admitted,
+            'max_connections': self.max_connections,
+            'admission_policy': self.admission_policy,
+            'admission': dict(self.admission_stats),
+            'idle_timeout': self.idle_timeout,
+            'reaped': self.reaped_connections,
+            'encodings': self._encoding_counts(),
+            'auth': {**self.auth_stats, 'sessions': sum(1 for client in list(self.clients.values()) if client.authenticated)},
+            'compression': self._compression_stats(),
+            'cache': self.cache.snapshot(),
+            'requests_stopped': dict(self.cancel_stats),
+            'rate_limit': self.rate_limiter.snapshot() if self.rate_limiter is not None else None,
+            'lanes': {
+                'fast': {'commands': sorted(self.inline_commands), 'completed': self.fast_completed},
+                'slow': self.slow_lane.snapshot() if self.slow_lane is not None else None
+            },
+            'du_cache': self.disk_usage.snapshot(),
+            'list_snapshots': self.list_snapshots.snapshot() if self.list_snapshots is not None else None,
+            'file_index': self.file_index.status() if self.file_index is not None else None
+        }
+        return {'status': 'success', 'result': result}
+    
+    def _encoding_counts(self):
+        """Connected clients by negotiated message encoding"""
+        counts = dict.fromkeys(ENCODINGS, 0)
+        for client in list(self.clients.values()):
+            counts[client.encoding] += 1
+        return counts
+    
+    def _compression_stats(self):
+        """Connected clients by negotiated compression, and the bytes it saved on their frames"""
+        counts = dict.fromkeys(COMPRESSIONS, 0)
+        raw_bytes = compressed_bytes = 0
+        for client in list(self.clients.values()):
+            if client.compression is not None:
+                counts[client.compression.name] += 1
+                raw_bytes += client.compression.raw_bytes
+                compressed_bytes += client.compression.compressed_bytes
+        return {'clients': counts, 'threshold': self.compress_threshold,
+                'raw_bytes': raw_bytes, 'compressed_bytes': compressed_bytes}
+    
+    def run_batch(self, args):
+        """Execute several commands in one request and return all their responses"""
+        entries = args.get('commands')
+        if not isinstance(entries, list) or not entries:
+            return {'status': 'error', 'error': 'No commands specified'}
+        if len(entries) > self.max_batch_size:
+            return {'status': 'error', 'error': f"Batch exceeds maximum of {self.max_batch_size} commands"}
+        
+        if args.get('concurrent'):
+            # Each entry runs in a copy of this context so it sees the batch's request
+            futures = [self.batch_executor.submit(contextvars.copy_context().run, self._run_batch_entry, entry)
+                       for entry in entries]
+            results = [future.result() for future in futures]
+        else:
+            results = []
+            for entry in entries:
+                current_request().check()
+                results.append(self._run_batch_entry(entry))
+        
+        return {'status': 'success', 'result': results}
+    
+    def _run_batch_entry(self, entry):
+        """Run one {command, args} entry of a batch request"""
+        if not isinstance(entry, dict):
+            return {'status': 'error', 'error': 'Invalid command format'}
+        command = entry.get('command', '')
+        if command == 'batch':
+            return {'status': 'error', 'error': 'Nested batch requests are not allowed'}
+        if isinstance(entry.get('args'), dict) and entry['args'].get('stream'):
+            return {'status': 'error', 'error': 'Streaming is not supported inside a batch'}
+        if command not in self.commands:
+            return {'status': 'error', 'error': f"Unknown command: {command}"}
+        try:
+            return self.execute(command, entry.get('args', {}))
         except Exception as e:
             return {'status': 'error', 'error': str(e)}
     
     def stop(self):
         """Stop the server and close all connections"""
         self.running = False
+        if self.slow_lane is not None:
+            self.slow_lane.shutdown()
+        self.batch_executor.shutdown(wait=False, cancel_futures=True)
+        self.walk_executor.shutdown(wait=False, cancel_futures=True)
+        if self.process_sampler is not None:
+            self.process_sampler.stop()
+        if self.file_index is not None:
+            self.file_index.stop()
+        if self.connection_pool is not None:
+            self.connection_pool.shutdown(wait=False, cancel_futures=True)
         
-        # Close client connections
-        for client_socket, _, _ in self.clients:
+        # In async mode the event loop owns every socket, so ask it to shut down
+        if self._loop is not None and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._shutdown_async)
+                logging.info(json.dumps({'event': 'server_stopped'}))
+                return
+            except RuntimeError:
+                pass
+        
+        # Close client connections; shutdown() wakes handlers blocked in recv(), close() alone does not
+        for client_socket in list(self.clients):
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             try:
                 client_socket.close()
             except:
                 pass
         
-        # Close server socket
+        # Close server socket (shutdown first so a blocked accept() wakes up)
         if self.server_socket:
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             try:
                 self.server_socket.close()
             except:
                 pass
         logging.info(json.dumps({'event': 'server_stopped'}))
 
+    def _shutdown_async(self):
+        """Close the asyncio server and all client streams (runs on the event loop)"""
+        if self._async_server is not None:
+            self._async_server.close()
+        if self._async_stopped is not None:
+            self._async_stopped.set()
+        for writer in list(self.clients):
+            writer.close()
+
     def _setup_logging(self):
         # Configure structured logging (JSON per line)
         logging.basicConfig(level=logging.INFO, format='%(message)s')
 
+def _run_worker(index, server_kwargs, shared_clients, supervisor_pid):
+    """Entry point of a worker process started by WorkerSupervisor"""
+    # Ctrl-C reaches the whole process group; the supervisor coordinates shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = RemoteCommandServer(**server_kwargs, reuse_port=True,
+                                 worker_index=index, shared_clients=shared_clients)
+    
+    def terminate(signum, frame):
+        server.stop()
+        # Unwinds server.start() in the main thread, so the process really ends
+        raise SystemExit(0)
+    
+    signal.signal(signal.SIGTERM, terminate)
+    
+    def watch_supervisor():
+        # A worker whose supervisor died without stopping it would otherwise serve on forever
+        while os.getppid() == supervisor_pid:
+            time.sleep(1.0)
+        server.stop()
+    
+    threading.Thread(target=watch_supervisor, daemon=True).start()
+    try:
+        server.start()
+    finally:
+        server.stop()
+
+
+class WorkerSupervisor:
+    """Run several server processes sharing one port via SO_REUSEPORT and restart any that die"""
+    
+    def __init__(self, workers, server_kwargs, check_interval=1.0, stop_timeout=5.0, max_backoff=60.0,
+                 stable_after=30.0):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+        self.workers = workers
+        self.server_kwargs = server_kwargs
+        self.check_interval = check_interval
+        self.stop_timeout = stop_timeout
+        self.shared_clients = multiprocessing.Array('i', workers, lock=False)
+        # Only the supervisor waits on this; workers are stopped with SIGTERM, since a worker killed
+        # while blocked on a shared multiprocessing.Event leaves it unable to ever be set
+        self.stop_event = threading.Event()
+        self.processes = [None] * workers
+        # A worker that keeps dying soon after starting is restarted after exponentially growing delays
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self._started_at = [0.0] * workers
+        self._failures = [0] * workers
+        self._restart_at = [None] * workers
+    
+    def run(self):
+        """Start all workers and supervise them until stop() is called"""
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        logging.info(json.dumps({'event': 'supervisor_started', 'workers': self.workers, 'pid': os.getpid()}))
+        for index in range(self.workers):
+            self._spawn(index)
+        
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if process.is_alive() or self.stop_event.is_set():
+                    continue
+                if self._restart_at[index] is None:
+                    if now - self._started_at[index] >= self.stable_after:
+                        self._failures[index] = 0
+                    delay = min(self.max_backoff, self.check_interval * (2 ** self._failures[index] - 1))
+                    self._failures[index] += 1
+                    self._restart_at[index] = now + delay
+                    self.shared_clients[index] = 0
+                    logging.warning(json.dumps({'event': 'worker_died', 'worker': index, 'pid': process.pid,
+                                                'exitcode': process.exitcode, 'restart_in': round(delay, 1)}))
+                if now >= self._restart_at[index]:
+                    self._restart_at[index] = None
+                    self._spawn(index)
+            self.stop_event.wait(self.check_interval)
+    
+    def _spawn(self, index):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(index, self.server_kwargs, self.shared_clients, os.getpid()),
+            name=f'rce-worker-{index}'
+        )
+        process.start()
+        self.processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logging.info(json.dumps({'event': 'worker_started', 'worker': index, 'pid': process.pid}))
+    
+    def client_count(self):
+        """Connected clients across all workers"""
+        return sum(self.shared_clients)
+    
+    def stop(self):
+        """Stop every worker with SIGTERM, escalating to SIGKILL for any that do not exit in time"""
+        self.stop_event.set()
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.warning(json.dumps({'event': 'worker_killed', 'worker': index, 'pid': process.pid}))
+                process.kill()
+                process.join()
+        logging.info(json.dumps({'event': 'supervisor_stopped'}))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Remote Command Execution Server with Predefined Commands")
     parser.add_argument("--host", default="127.0.0.1", help="Host to bind the server to")
     parser.add_argument("--port", type=int, default=9999, help="Port to bind the server to")
     parser.add_argument("--token", default=os.environ.get('RCE_TOKEN'), help="Auth token (or set RCE_TOKEN env var)")
+    parser.add_argument("--mode", choices=['threaded', 'async'], default='threaded', help="Serving model: one thread per client or a single asyncio event loop")
+    parser.add_argument("--max-frame-size", type=int, default=DEFAULT_MAX_FRAME_SIZE, help="Largest request frame accepted, in bytes")
+    parser.add_argument("--batch-workers", type=int, default=8, help="Threads for running concurrent batch entries")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="Most commands accepted in one batch request")
+    parser.add_argument("--max-connections", type=int, default=None, help="Connections served at once (default: 256 threaded, 16384 async)")
+    parser.add_argument("--admission-policy", choices=RemoteCommandServer.ADMISSION_POLICIES, default='queue', help="What to do with connections beyond --max-connections")
+    parser.add_argument("--queue-size", type=int, default=64, help="Connections allowed to wait for a slot with the 'queue' policy")
+    parser.add_argument("--backlog", type=int, default=128, help="Listen backlog for the server socket")
+    parser.add_argument("--cache-ttl", action='append', default=[], metavar='COMMAND=SECONDS', help="Result cache TTL for a command; 0 disables caching it (repeatable)")
+    parser.add_argument("--command-timeout", action='append', default=[], metavar='COMMAND=SECONDS', help="Longest a command may run; 0 removes the limit (repeatable)")
+    parser.add_argument("--idle-timeout", type=float, default=600.0, help="Close connections idle this many seconds (0 = never)")
+    parser.add_argument("--keepalive-idle", type=int, default=60, help="Seconds of silence before TCP keepalive probes start (0 = no keepalive)")
+    parser.add_argument("--keepalive-interval", type=int, default=10, help="Seconds between TCP keepalive probes")
+    parser.add_argument("--keepalive-count", type=int, default=6, help="Unanswered keepalive probes before the connection is dropped")
+    parser.add_argument("--no-legacy-token", action='store_true', help="Only accept the hello/auth handshake, not a token inside each request")
+    parser.add_argument("--compress-threshold", type=int, default=DEFAULT_COMPRESS_THRESHOLD, help="Smallest frame compressed for clients that negotiate compression, in bytes")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Rate-limit tokens per second for each client IP, per worker process (default: no limit)")
+    parser.add_argument("--rate-burst", type=float, default=None, help="Tokens a client may spend at once (default: twice --rate-limit)")
+    parser.add_argument("--command-cost", action='append', default=[], metavar='COMMAND=TOKENS', help="Rate-limit cost of a command (repeatable)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Most responses kept in the result cache")
+    parser.add_argument("--hostname-ttl", type=float, default=None, help="Seconds before the memoized hostname/FQDN is refreshed (default: never)")
+    parser.add_argument("--process-sample-interval", type=float, default=2.0, help="Seconds between background process table samples for processlist; 0 scans on demand")
+    parser.add_argument("--max-find-results", type=int, default=10000, help="Most matches findfile returns per request or stream")
+    parser.add_argument("--index-root", action='append', default=[], metavar='PATH', help="Directory tree to keep a filename index of for findfile (repeatable)")
+    parser.add_argument("--index-dir", default=None, help="Where to persist filename indexes between restarts (default: memory only)")
+    parser.add_argument("--index-rescan-interval", type=float, default=3600.0, help="Seconds between full rescans of indexed trees")
+    parser.add_argument("--max-list-results", type=int, default=10000, help="Largest page of entries listdir returns per request")
+    parser.add_argument("--list-snapshot-entries", type=int, default=2000000, help="Sort keys of paged listings kept so later pages skip the rescan (0 = rescan every page)")
+    parser.add_argument("--du-cache-size", type=int, default=1000000, help="Directories whose usage du remembers between runs")
+    parser.add_argument("--du-cache-max-age", type=float, default=300.0, help="Seconds du reuses a directory's remembered usage (0 = never)")
+    parser.add_argument("--max-ping-hosts", type=int, default=1024, help="Most hosts one ping request may list")
+    parser.add_argument("--ping-concurrency", type=int, default=256, help="Ping processes one request may run at once")
+    parser.add_argument("--walk-workers", type=int, default=16, help="Directory reads each recursive walk keeps in flight (and size of the shared walk pool)")
+    parser.add_argument("--walk-max-entries", type=int, default=1000000, help="Entries one findfile request may examine before returning a cursor; 0 for no limit")
+    parser.add_argument("--workers", type=int, default=1, help="Number of server processes sharing the port via SO_REUSEPORT")
+    parser.add_argument("--executor-workers", type=int, default=None, help="Slow-lane threads: how many non-trivial commands run at once (default: Python's ThreadPoolExecutor default)")
+    parser.add_argument("--lane-queue-size", type=int, default=256, help="Slow-lane requests allowed to wait for a thread before new ones are refused as busy")
     args = parser.parse_args()
 
     # Check for psutil package
@@ -402,10 +2340,52 @@ if __name__ == "__main__":
         print("[-] Warning: psutil package not found. Some commands will not work.")
         print("[-] Install it with: pip install psutil")
 
-    server = RemoteCommandServer(args.host, args.port, auth_token=args.token)
+    cache_ttls = {}
+    for item in args.cache_ttl:
+        command, _, seconds = item.partition('=')
+        cache_ttls[command] = float(seconds)
+
+    command_timeouts = {}
+    for item in args.command_timeout:
+        command, _, seconds = item.partition('=')
+        command_timeouts[command] = float(seconds)
+
+    command_costs = {}
+    for item in args.command_cost:
+        command, _, tokens = item.partition('=')
+        command_costs[command] = float(tokens)
+
+    server_kwargs = dict(host=args.host, port=args.port, auth_token=args.token,
+                         mode=args.mode, executor_workers=args.executor_workers,
+                         max_frame_size=args.max_frame_size,
+                         batch_workers=args.batch_workers, max_batch_size=args.max_batch_size,
+                         max_connections=args.max_connections, admission_policy=args.admission_policy,
+                         queue_size=args.queue_size, backlog=args.backlog,
+                         cache_ttls=cache_ttls, cache_size=args.cache_size,
+                         command_timeouts=command_timeouts,
+                         hostname_ttl=args.hostname_ttl,
+                         process_sample_interval=args.process_sample_interval,
+                         max_find_results=args.max_find_results, index_roots=args.index_root,
+                         index_dir=args.index_dir, index_rescan_interval=args.index_rescan_interval,
+                         walk_workers=args.walk_workers, walk_max_entries=args.walk_max_entries,
+                         max_list_results=args.max_list_results,
+                         list_snapshot_entries=args.list_snapshot_entries, du_cache_size=args.du_cache_size,
+                         du_cache_max_age=args.du_cache_max_age,
+                         max_ping_hosts=args.max_ping_hosts, ping_concurrency=args.ping_concurrency,
+                         lane_queue_size=args.lane_queue_size, rate_limit=args.rate_limit,
+                         rate_burst=args.rate_burst, command_costs=command_costs,
+                         compress_threshold=args.compress_threshold, legacy_token_auth=not args.no_legacy_token,
+                         idle_timeout=args.idle_timeout, keepalive_idle=args.keepalive_idle,
+                         keepalive_interval=args.keepalive_interval, keepalive_count=args.keepalive_count)
+    if args.workers > 1:
+        server = WorkerSupervisor(args.workers, server_kwargs)
+        run = server.run
+    else:
+        server = RemoteCommandServer(**server_kwargs)
+        run = server.start
 
     try:
-        server.start()
+        run()
     except KeyboardInterrupt:
         logging.info(json.dumps({'event': 'keyboard_interrupt'}))
     finally:
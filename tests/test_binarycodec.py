@@ -0,0 +1,133 @@
+import json
+import os
+import struct
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import binarycodec
+from binarycodec import PackError, packb, unpackb
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Values covering every type and every length/size boundary of the format
+SAMPLES = [
+    None, True, False,
+    0, 1, 127, 128, 255, 256, 65535, 65536, 2**32 - 1, 2**32, 2**64 - 1,
+    -1, -32, -33, -128, -129, -32768, -32769, -2**31, -2**31 - 1, -2**63,
+    0.0, -1.5, 3.141592653589793, 1e300,
+    '', 'a', 'x' * 31, 'x' * 32, 'x' * 255, 'x' * 256, 'x' * 65535, 'x' * 65536,
+    'héllo wörld', '日本語', '\U0001f600',
+    [], [1, 2, 3], list(range(15)), list(range(16)), list(range(65536)),
+    {}, {'a': 1}, {str(i): i for i in range(15)}, {str(i): i for i in range(16)},
+    {str(i): i for i in range(65536)},
+    {'status': 'success', 'result': [{'name': 'f', 'size': 4096, 'modified': 1.5, 'is_dir': False}] * 3,
+     'count': 3, 'cursor': None, 'id': 7},
+    {'nested': {'deeper': [{'k': [None, True, -5, 'v' * 40]}]}},
+    {1: 'int key', 'x' * 40: 'long key'},
+]
+
+# Names os.scandir and os.fsdecode return for filenames that are not UTF-8
+SURROGATE_NAMES = [os.fsdecode(b'log\xff.txt'), os.fsdecode(b'\xe9t\xe9'), os.fsdecode(b'\xff' * 300)]
+
+
+class PurePython:
+    """Runs a test case against the pure-Python codec even when the extension is installed"""
+
+    def setUp(self):
+        patcher = mock.patch.object(binarycodec, 'msgpack', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class RoundTripTest(PurePython, unittest.TestCase):
+
+    def test_samples_round_trip(self):
+        for value in SAMPLES:
+            with self.subTest(value=repr(value)[:60]):
+                self.assertEqual(unpackb(packb(value)), value)
+
+    def test_tuples_pack_as_arrays(self):
+        self.assertEqual(unpackb(packb((1, 'a', (2,)))), [1, 'a', [2]])
+
+    def test_known_encodings(self):
+        self.assertEqual(packb(None), b'\xc0')
+        self.assertEqual(packb(True), b'\xc3')
+        self.assertEqual(packb(5), b'\x05')
+        self.assertEqual(packb(-1), b'\xff')
+        self.assertEqual(packb(200), b'\xcc\xc8')
+        self.assertEqual(packb(-200), b'\xd1\xff\x38')
+        self.assertEqual(packb(1.5), b'\xcb' + struct.pack('>d', 1.5))
+        self.assertEqual(packb('ab'), b'\xa2ab')
+        self.assertEqual(packb('x' * 32)[:2], b'\xd9\x20')
+        self.assertEqual(packb([1, 2]), b'\x92\x01\x02')
+        self.assertEqual(packb({'a': 1}), b'\x81\xa1a\x01')
+
+    def test_float32_decodes(self):
+        self.assertEqual(unpackb(b'\xca' + struct.pack('>f', 0.5)), 0.5)
+
+    def test_integer_out_of_range(self):
+        for value in (2**64, -2**63 - 1):
+            with self.subTest(value=value):
+                with self.assertRaises(OverflowError):
+                    packb(value)
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            packb(object())
+
+    def test_malformed_data(self):
+        for data in (b'\xa5ab', b'\x92\x01', b'\xcd\x01', b'\xc1', b'\x01\x02', b'\xdc\x00\x05\x01'):
+            with self.subTest(data=data):
+                with self.assertRaises(PackError):
+                    unpackb(data)
+
+
+class SurrogateTest(PurePython, unittest.TestCase):
+
+    def test_sent_as_original_bytes(self):
+        self.assertEqual(packb(SURROGATE_NAMES[0]), b'\xc4\x08log\xff.txt')
+
+    def test_round_trip_matches_json(self):
+        for name in SURROGATE_NAMES:
+            message = {'status': 'success', 'result': [{'path': '/var/log/' + name, name: name}], 'id': 1}
+            with self.subTest(name=name[:20]):
+                self.assertEqual(unpackb(packb(message)), json.loads(json.dumps(message)))
+
+    def test_other_lone_surrogates_do_not_raise(self):
+        self.assertIsInstance(unpackb(packb('\ud800x')), str)
+
+
+@unittest.skipUnless(msgpack is not None, "msgpack is not installed")
+class ExtensionTest(unittest.TestCase):
+
+    def pure_packb(self, value):
+        with mock.patch.object(binarycodec, 'msgpack', None):
+            return packb(value)
+
+    def test_same_bytes_as_extension(self):
+        for value in SAMPLES:
+            with self.subTest(value=repr(value)[:60]):
+                self.assertEqual(self.pure_packb(value), msgpack.packb(value, use_bin_type=True))
+
+    def test_extension_reads_pure_python_bytes(self):
+        for value in SAMPLES:
+            with self.subTest(value=repr(value)[:60]):
+                self.assertEqual(unpackb(self.pure_packb(value)), value)
+
+    def test_surrogates_with_extension(self):
+        for name in SURROGATE_NAMES:
+            message = {'result': [name], name: 1}
+            with self.subTest(name=name[:20]):
+                self.assertEqual(packb(message), self.pure_packb(message))
+                self.assertEqual(unpackb(packb(message)), message)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from protocol import FrameReader, decode_message, encode_message
+
+# Runs a server with the given constructor arguments. 'du' is replaced by a handler that only
+# ends when its request is stopped, standing in for a long walk that checks for cancellation.
+LAUNCHER = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+import server
+
+def wait_until_stopped(self, args):
+    while True:
+        server.current_request().check()
+        time.sleep(0.01)
+
+server.RemoteCommandServer.get_directory_usage = wait_until_stopped
+server.RemoteCommandServer(**json.loads(sys.argv[2])).start()
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Connection:
+    """Raw framed JSON connection to a test server"""
+
+    def __init__(self, port):
+        self.socket = socket.create_connection(('127.0.0.1', port), timeout=10)
+        self.frames = FrameReader()
+        self.responses = {}
+
+    def send(self, **request):
+        self.socket.sendall(encode_message(request))
+
+    def receive(self, request_id):
+        """Read frames until the response to request_id arrives, keeping any others"""
+        while request_id not in self.responses:
+            body = self.frames.recv_frame(self.socket)
+            if body is None:
+                raise ConnectionError("Connection closed by server")
+            response = decode_message(body)
+            self.responses[response.get('id')] = response
+        return self.responses.pop(request_id)
+
+    def request(self, request_id, command, args=None, **fields):
+        self.send(id=request_id, command=command, args=args or {}, **fields)
+        return self.receive(request_id)
+
+    def close(self):
+        self.socket.close()
+
+
+class ServerTest:
+    """Starts a server process on a free port for the test case's class"""
+
+    mode = 'threaded'
+    server_kwargs = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.port = free_port()
+        kwargs = {'host': '127.0.0.1', 'port': cls.port, 'mode': cls.mode, **cls.server_kwargs}
+        cls.log = tempfile.TemporaryFile()
+        cls.process = subprocess.Popen([sys.executable, '-c', LAUNCHER, ROOT, json.dumps(kwargs)],
+                                       stdout=cls.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', cls.port), timeout=1).close()
+                break
+            except OSError:
+                if cls.process.poll() is not None or time.monotonic() > deadline:
+                    cls.tearDownClass()
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.process.kill()
+        cls.process.wait()
+        cls.log.close()
+
+    def connect(self):
+        connection = Connection(self.port)
+        self.addCleanup(connection.close)
+        return connection
+
+
+class StopRequestTest(ServerTest):
+
+    server_kwargs = {'executor_workers': 1, 'lane_queue_size': 0}
+
+    def test_cancel(self):
+        connection = self.connect()
+        connection.send(id=1, command='du', args={'path': '.'})
+        cancelled = connection.request(2, 'cancel', {'id': 1})
+        self.assertEqual(cancelled['result'], {'id': 1, 'cancelled': True})
+        response = connection.receive(1)
+        self.assertEqual((response['status'], response['code']), ('error', 'cancelled'))
+
+    def test_cancel_unknown_request(self):
+        response = self.connect().request(1, 'cancel', {'id': 99})
+        self.assertEqual(response['result'], {'id': 99, 'cancelled': False})
+
+    def test_deadline_zero(self):
+        connection = self.connect()
+        for request_id, command in enumerate(('listdir', 'du'), 1):
+            with self.subTest(command=command):
+                response = connection.request(request_id, command, {'path': '.'}, deadline=0)
+                self.assertEqual((response['status'], response['code']), ('error', 'timeout'))
+
+    def test_deadline_stops_running_request(self):
+        response = self.connect().request(1, 'du', {'path': '.'}, deadline=0.2)
+        self.assertEqual(response['code'], 'timeout')
+
+    def test_busy_when_lane_is_full(self):
+        connection = self.connect()
+        connection.send(id=1, command='du', args={'path': '.'})
+        busy = connection.request(2, 'listdir', {'path': '.'})
+        self.assertEqual((busy['status'], busy['code']), ('error', 'busy'))
+        # Fast-lane commands are still answered
+        self.assertEqual(connection.request(3, 'echo', {'message': 'hi'})['status'], 'success')
+        connection.request(4, 'cancel', {'id': 1})
+        self.assertEqual(connection.receive(1)['code'], 'cancelled')
+
+
+class AsyncStopRequestTest(StopRequestTest, unittest.TestCase):
+    mode = 'async'
+
+
+class ThreadedStopRequestTest(StopRequestTest, unittest.TestCase):
+    pass
+
+
+class ThrottleTest(ServerTest, unittest.TestCase):
+
+    server_kwargs = {'rate_limit': 0.01, 'rate_burst': 2}
+
+    def test_throttled_over_burst(self):
+        connection = self.connect()
+        self.assertEqual(connection.request(1, 'echo', {'message': 'a'})['status'], 'success')
+        self.assertEqual(connection.request(2, 'echo', {'message': 'b'})['status'], 'success')
+        response = connection.request(3, 'echo', {'message': 'c'})
+        self.assertEqual((response['status'], response['code']), ('error', 'throttled'))
+        self.assertGreater(response['retry_after'], 0)
+
+
+class PagingTest(ServerTest):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tree = tempfile.mkdtemp()
+        for i in range(23):
+            with open(os.path.join(cls.tree, f'file{i:02d}.txt'), 'wb') as f:
+                f.write(b'x' * ((i * 7) % 23))
+        for d in ('a', 'b', 'b/c'):
+            os.makedirs(os.path.join(cls.tree, d))
+            for i in range(5):
+                open(os.path.join(cls.tree, d, f'file{i}.log'), 'w').close()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.tree)
+
+    def pages(self, connection, command, args, resume_args=None):
+        """Follow cursors from a first request, returning every page"""
+        pages = [connection.request(1, command, args)]
+        while pages[-1].get('cursor'):
+            self.assertEqual(pages[-1]['status'], 'success')
+            pages.append(connection.request(len(pages) + 1, command,
+                                            {**(resume_args or {}), 'cursor': pages[-1]['cursor']}))
+        self.assertEqual(pages[-1]['status'], 'success')
+        return pages
+
+    def test_listdir_pages_cover_directory_once(self):
+        connection = self.connect()
+        names = sorted(os.listdir(self.tree))
+        sizes = {name: os.stat(os.path.join(self.tree, name)).st_size for name in names}
+        for sort in ('name', 'size'):
+            for reverse in (False, True):
+                with self.subTest(sort=sort, reverse=reverse):
+                    pages = self.pages(connection, 'listdir', {'path': self.tree, 'limit': 4, 'sort': sort,
+                                                               'reverse': reverse})
+                    self.assertTrue(all(len(page['result']) <= 4 for page in pages))
+                    listed = [entry['name'] for page in pages for entry in page['result']]
+                    self.assertEqual(sorted(listed), names)
+                    if sort == 'name':
+                        self.assertEqual(listed, sorted(names, reverse=reverse))
+                    else:
+                        keys = [sizes[name] for name in listed]
+                        self.assertEqual(keys, sorted(keys, reverse=reverse))
+
+    def test_listdir_limit_below_one(self):
+        connection = self.connect()
+        for limit in (0, -1):
+            with self.subTest(limit=limit):
+                response = connection.request(1, 'listdir', {'path': self.tree, 'limit': limit})
+                self.assertEqual(response['status'], 'error')
+
+    def test_findfile_pages_match_single_request(self):
+        connection = self.connect()
+        args = {'path': self.tree, 'pattern': 'file', 'limit': 1000}
+        everything = [match['path'] for match in connection.request(1, 'findfile', args)['result']]
+        self.assertEqual(len(everything), 38)
+        # Unlike listdir's, findfile's page size is not part of the cursor
+        pages = self.pages(connection, 'findfile', {**args, 'pattern': 'FILE', 'limit': 6}, {'limit': 6})
+        self.assertEqual(len(pages), 7)
+        self.assertTrue(all(len(page['result']) <= 6 for page in pages))
+        self.assertEqual([match['path'] for page in pages for match in page['result']], everything)
+
+    def test_findfile_limit_below_one(self):
+        connection = self.connect()
+        for limit in (0, -1):
+            with self.subTest(limit=limit):
+                response = connection.request(1, 'findfile', {'path': self.tree, 'pattern': 'file', 'limit': limit})
+                self.assertEqual(response['status'], 'error')
+                self.assertNotIn('cursor', response)
+
+
+class AsyncPagingTest(PagingTest, unittest.TestCase):
+    mode = 'async'
+
+
+class ThreadedPagingTest(PagingTest, unittest.TestCase):
+    pass
+
+
+class RescanPagingTest(PagingTest, unittest.TestCase):
+    # Every listdir page selected by a fresh pass over the directory
+    server_kwargs = {'list_snapshot_entries': 0}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# walker.py
+"""Parallel directory walker used by findfile and other recursive commands.
+
+Entries are produced in the same depth-first, name-ordered sequence as a plain
+recursive os.scandir walk, so positions stay usable as resume points. What
+runs in parallel is the directory reading: while the caller consumes one
+directory, the directories it will visit next are already being listed by a
+thread pool. On network filesystems, where every readdir is a round trip,
+this hides most of the latency.
+"""
+import heapq
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+READ_AHEAD_FACTOR = 8
+
+
+class ParallelWalker:
+    """One walk over a directory tree, reading directories ahead on an executor
+
+    max_outstanding bounds the directory reads in flight at once, which bounds
+    the load put on the filesystem; finished listings waiting for the consumer
+    are capped at READ_AHEAD_FACTOR times that, which bounds memory.
+    max_depth stops descending below that many levels under the root, and
+    max_entries stops the walk after that many entries (truncated is then set
+    and last_position tells where to resume). check, if given, is called
+    before each directory is read and may raise to abort the walk.
+    """
+
+    def __init__(self, executor, max_outstanding=16, max_depth=None, max_entries=None, check=None):
+        self.executor = executor
+        self.check = check
+        self.max_outstanding = max(1, max_outstanding)
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self.entries_seen = 0
+        self.truncated = False
+        self.last_position = None
+        self._resume = ()
+        self._pending = {}
+        self._discovered = set()
+        self._queued = []
+
+    def walk(self, root, resume=()):
+        """Yield (DirEntry, position) pairs below root
+
+        position is the tuple of names leading from root to the entry.
+        Passing a previously yielded position as resume continues right after
+        that entry.
+        """
+        self._resume = tuple(resume)
+        try:
+            yield from self._walk(root, self._resume, ())
+        finally:
+            # Stopped early (result limit reached or consumer gone): drop the read-ahead
+            for _, future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            self._discovered.clear()
+            self._queued.clear()
+
+    def _walk(self, directory, resume, position):
+        resume_name = resume[0] if resume else None
+        descend = self._descends(position)
+        for entry in self._listing(directory, position):
+            if resume_name is not None and entry.name < resume_name:
+                continue
+            entry_position = position + (entry.name,)
+            if entry.name != resume_name:
+                if self.max_entries is not None and self.entries_seen >= self.max_entries:
+                    self.truncated = True
+                    return
+                self.entries_seen += 1
+                self.last_position = entry_position
+                yield entry, entry_position
+            # Directory types come from readdir, so no extra stat unless it is a symlink
+            if descend and entry.is_dir(follow_symlinks=False):
+                yield from self._walk(entry.path, resume[1:] if entry.name == resume_name else (), entry_position)
+                if self.truncated:
+                    return
+
+    def _descends(self, position):
+        """Whether the walk lists the subdirectories of the directory at position"""
+        return self.max_depth is None or len(position) + 1 < self.max_depth
+
+    def _listing(self, directory, position):
+        """Sorted entries of directory, from the read-ahead if it got there first"""
+        if self.check is not None:
+            self.check()
+        _, future = self._pending.pop(directory, (None, None))
+        if future is None:
+            # Not submitted yet, so it is the next directory in walk order
+            if self._queued and self._queued[0][1] == directory:
+                heapq.heappop(self._queued)
+            entries = _scan(directory)
+        else:
+            # Keep the pool busy with what comes next while waiting for this one
+            while not future.done():
+                running = [f for _, f in self._pending.values() if not f.done()]
+                wait([future, *running], return_when=FIRST_COMPLETED)
+                self._read_ahead()
+            entries = future.result()
+        self._discover(directory, position, entries)
+        self._discovered.discard(directory)
+        self._read_ahead()
+        return entries
+
+    def _discover(self, directory, position, entries):
+        """Queue the subdirectories of a listed directory that the walk will visit"""
+        if directory in self._discovered:
+            return
+        self._discovered.add(directory)
+        if not self._descends(position):
+            return
+        for entry in entries:
+            child = position + (entry.name,)
+            # Entries before the resume point are skipped, apart from the directories leading to it
+            if child < self._resume and self._resume[:len(child)] != child:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                heapq.heappush(self._queued, (child, entry.path))
+
+    def _read_ahead(self):
+        """Expand finished reads and submit the directories that come next in walk order"""
+        in_flight = 0
+        for directory, (position, future) in list(self._pending.items()):
+            if not future.done():
+                in_flight += 1
+            elif not future.cancelled():
+                self._discover(directory, position, future.result())
+        while (self._queued and in_flight < self.max_outstanding
+               and len(self._pending) < self.max_outstanding * READ_AHEAD_FACTOR):
+            in_flight += 1
+            position, path = heapq.heappop(self._queued)
+            self._pending[path] = (position, self.executor.submit(_scan, path))
+
+
+def _scan(directory):
+    try:
+        with os.scandir(directory) as it:
+            return sorted(it, key=lambda e: e.name)
+    except OSError:
+        return []